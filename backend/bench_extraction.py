@@ -0,0 +1,71 @@
+"""Benchmark the article extraction backends over a directory of saved pages.
+
+Usage:
+    python bench_extraction.py path/to/corpus [--repeat 5] [--profile news]
+
+Every *.html / *.htm file under the corpus directory is run through each
+available backend (legacy BeautifulSoup find_all, the stdlib tokenizer and,
+when installed, lxml). Reports median parse time, peak traced memory and
+output size per backend.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from extraction import ARTICLE_BACKENDS, extract_article_text
+
+
+def load_corpus(directory: str) -> list[tuple[str, bytes]]:
+    pages = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith((".html", ".htm")):
+                with open(os.path.join(root, name), "rb") as f:
+                    pages.append((name, f.read()))
+    return pages
+
+
+def measure(backend: str, html: bytes, profile: str, repeat: int) -> tuple[float, int, int]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        extract_article_text(html, profile, backend=backend)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    text = extract_article_text(html, profile, backend=backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings) if timings else 0.0, peak, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Directory of saved HTML pages")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per page (0 only measures memory)")
+    parser.add_argument("--profile", default="webpage", choices=["webpage", "news"])
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus)
+    if not pages:
+        sys.exit(f"No .html files found under {args.corpus}")
+
+    input_bytes = sum(len(html) for _, html in pages)
+    print(f"{len(pages)} pages, {input_bytes / 1024:.0f} KiB, profile={args.profile}, repeat={args.repeat}\n")
+    print(f"{'backend':<10} {'total ms':>10} {'median ms':>10} {'peak KiB':>10} {'output KiB':>11}")
+
+    for backend in ARTICLE_BACKENDS:
+        results = [measure(backend, html, args.profile, args.repeat) for _, html in pages]
+        seconds = [r[0] for r in results]
+        print(
+            f"{backend:<10} {sum(seconds) * 1000:>10.1f} {statistics.median(seconds) * 1000:>10.2f} "
+            f"{max(r[1] for r in results) / 1024:>10.0f} {sum(r[2] for r in results) / 1024:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Functions run in the CPU pool's worker processes.
+
+Workers are spawned, so everything they execute is pickled by reference and
+its module is imported in each worker. This module (and extraction.py) have
+no import-time side effects, unlike main.py, which would build the app and
+its clients in every worker. Spawn also re-runs the parent's __main__, so
+this only pays off when the app is served as `uvicorn main:app`; under
+`python main.py` the pool is left off (see CPUPool.start).
+"""
+
+from multiprocessing import shared_memory
+from typing import Any, Callable
+
+import feedparser
+
+from extraction import extract_article_text
+
+__all__ = ["call_with_shared_payload", "extract_article_text", "parse_feed_entries"]
+
+
+def call_with_shared_payload(fn: Callable[..., Any], name: str, size: int, *args: Any) -> Any:
+    """Worker-side trampoline: copy the payload out of shared memory and call `fn`."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        payload = bytes(block.buf[:size])
+    finally:
+        block.close()
+    return fn(payload, *args)
+
+
+def parse_feed_entries(content: bytes, source_name: str, limit: int = 10) -> list[dict[str, str]]:
+    # Only the small entry dicts travel back to the app process
+    feed = feedparser.parse(content)
+    items = []
+    for entry in feed.entries[:limit]:
+        items.append({
+            "title": entry.title,
+            "link": entry.link,
+            "published": entry.get('published', ''),
+            "source": source_name
+        })
+    return items
@@ -0,0 +1,251 @@
+"""Main-content extraction for fetched pages.
+
+Kept apart from main.py with no import-time side effects, so the CPU pool's
+spawn workers and bench_extraction.py can import it without pulling in the
+app, its clients and its settings.
+"""
+
+import os
+import re
+from html.parser import HTMLParser
+from typing import Any, Callable
+
+# Pages are reduced to text blocks in a single pass, without building a soup
+# tree. Text belongs only to its innermost block, so nested article/section
+# content is never counted twice. Containers are scored readability-style and
+# only the best one's blocks are kept. lxml drives the pass when installed;
+# otherwise the stdlib HTMLParser tokenizer does. "legacy" is the old
+# BeautifulSoup find_all behaviour, kept for comparison.
+ARTICLE_BACKEND = os.getenv("ARTICLE_BACKEND", "auto")
+ARTICLE_MIN_CHARS = 250
+SKIPPED_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe",
+    "nav", "footer", "aside", "form", "button", "select", "head",
+}
+BLOCK_TAGS = {
+    "p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "pre", "blockquote",
+    "dd", "dt", "figcaption", "td", "th", "caption",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+BLOCK_BREAK_TAGS = BLOCK_TAGS | {"div", "section", "article", "main", "header", "ul", "ol", "dl", "table", "figure"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+CONTAINER_BONUS = {"article": 10, "main": 10, "section": 3, "div": 5, "td": 3, "blockquote": 3, "pre": 3, "body": 0}
+POSITIVE_HINTS = re.compile(r"article|body|content|entry|main|page|post|story|text|blog", re.I)
+NEGATIVE_HINTS = re.compile(
+    r"comment|combx|community|disqus|footer|menu|meta|nav|outbrain|promo|related|remark|"
+    r"share|shoutbox|sidebar|skyscraper|sponsor|social|subscribe|tags|widget|cookie|banner|\bad\b|ads",
+    re.I,
+)
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+
+class BlockBuilder:
+    """Parser target collecting text blocks and container scores.
+
+    Implements lxml's target interface (start/end/data/close); the stdlib
+    tokenizer adapts its handle_* callbacks onto it.
+    """
+
+    def __init__(self):
+        self.stack: list[tuple[str, int]] = []  # (tag, container id or -1)
+        self.containers: list[dict[str, Any]] = []
+        self.blocks: list[dict[str, Any]] = []
+        self.block: dict[str, Any] | None = None
+        self.block_depth = 0
+        self.skip_depth = 0
+        self.link_depth = 0
+
+    def start(self, tag: Any, attrib: Any):
+        if not isinstance(tag, str):
+            return  # lxml comments / processing instructions
+        tag = tag.lower()
+        if tag in VOID_TAGS:
+            if tag == "br" and self.block is not None:
+                self.block["parts"].append(" ")
+            return
+        if self.skip_depth or tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+            self.stack.append((tag, -1))
+            return
+        if tag == "a":
+            self.link_depth += 1
+        if self.block is not None and tag in BLOCK_BREAK_TAGS:
+            # A block-level tag ends the open block, so unclosed siblings
+            # (<p>a<p>b, <li>a<li>b) come out as separate blocks
+            self._close_block()
+        if tag in BLOCK_TAGS and self.block is None:
+            self._open_block(tag)
+            self.stack.append((tag, -1))
+            self.block_depth = len(self.stack)
+            return
+        container_id = -1
+        if self.block is None:
+            attrs = dict(attrib or {})
+            hints = f"{attrs.get('class') or ''} {attrs.get('id') or ''}"
+            weight = CONTAINER_BONUS.get(tag, 0)
+            if POSITIVE_HINTS.search(hints):
+                weight += 25
+            if NEGATIVE_HINTS.search(hints):
+                weight -= 25
+            container_id = len(self.containers)
+            self.containers.append({"tag": tag, "weight": weight, "score": 0.0, "chars": 0, "link_chars": 0})
+        self.stack.append((tag, container_id))
+
+    def end(self, tag: Any):
+        if not isinstance(tag, str):
+            return
+        tag = tag.lower()
+        if tag in VOID_TAGS or not any(open_tag == tag for open_tag, _ in self.stack):
+            return  # Stray end tag from malformed markup
+        while self.stack:
+            open_tag, _ = self.stack.pop()
+            if self.skip_depth:
+                self.skip_depth -= 1
+            elif open_tag == "a":
+                self.link_depth = max(self.link_depth - 1, 0)
+            if self.block is not None and len(self.stack) < self.block_depth:
+                self._close_block()
+            if open_tag == tag:
+                break
+
+    def data(self, text: str):
+        if self.skip_depth or not text.strip():
+            return
+        if self.block is None:
+            self._open_block("#text")  # Bare text directly inside a container
+            self.block_depth = len(self.stack)
+        self.block["parts"].append(text)
+        if self.link_depth:
+            self.block["link_chars"] += len(text.strip())
+
+    def close(self):
+        if self.block is not None:
+            self._close_block()
+        return self
+
+    def _open_block(self, tag: str):
+        ancestors = tuple(cid for _, cid in self.stack if cid >= 0)
+        self.block = {"tag": tag, "parts": [], "link_chars": 0, "ancestors": ancestors}
+
+    def _close_block(self):
+        block, self.block = self.block, None
+        self.block_depth = 0
+        text = " ".join("".join(block["parts"]).split())
+        if not text:
+            return
+        block["text"] = text
+        del block["parts"]
+        self.blocks.append(block)
+        link_density = min(block["link_chars"] / len(text), 1.0)
+        score = (1 + text.count(",") + min(len(text) / 100, 3)) * (1 - link_density)
+        # Credit the parent in full and the grandparent by half, as readability does
+        for depth, cid in enumerate(reversed(block["ancestors"][-2:])):
+            self.containers[cid]["score"] += score / (1 + depth)
+        for cid in block["ancestors"]:
+            self.containers[cid]["chars"] += len(text)
+            self.containers[cid]["link_chars"] += block["link_chars"]
+
+    def main_content(self) -> str:
+        best, best_score = None, 0.0
+        for cid, container in enumerate(self.containers):
+            if not container["score"]:
+                continue
+            link_density = container["link_chars"] / container["chars"] if container["chars"] else 0.0
+            score = (container["score"] + container["weight"]) * (1 - link_density)
+            if score > best_score:
+                best, best_score = cid, score
+
+        def keep(block: dict[str, Any]) -> bool:
+            link_density = block["link_chars"] / len(block["text"])
+            return link_density < 0.5 and (block["tag"] in HEADING_TAGS or len(block["text"]) >= 25)
+
+        chosen = [b for b in self.blocks if best in b["ancestors"] and keep(b)] if best is not None else []
+        if sum(len(b["text"]) for b in chosen) < ARTICLE_MIN_CHARS:
+            chosen = [b for b in self.blocks if keep(b)]
+        seen: set[str] = set()
+        texts = []
+        for block in chosen:
+            if block["text"] not in seen:
+                seen.add(block["text"])
+                texts.append(block["text"])
+        return "\n\n".join(texts)
+
+
+class TokenizerAdapter(HTMLParser):
+    def __init__(self, builder: BlockBuilder):
+        super().__init__(convert_charrefs=True)
+        self.builder = builder
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start(tag, attrs)
+        if tag in VOID_TAGS:
+            self.builder.end(tag)
+
+    def handle_endtag(self, tag):
+        self.builder.end(tag)
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+
+def decode_html(html: bytes) -> str:
+    head = html[:2048].decode("ascii", "ignore")
+    match = re.search(r"charset=[\"']?([\w-]+)", head, re.I)
+    encoding = match.group(1) if match else "utf-8"
+    try:
+        return html.decode(encoding, "replace")
+    except LookupError:
+        return html.decode("utf-8", "replace")
+
+
+def extract_with_tokenizer(html: bytes, profile: str) -> str:
+    builder = BlockBuilder()
+    tokenizer = TokenizerAdapter(builder)
+    tokenizer.feed(decode_html(html))
+    tokenizer.close()
+    return builder.close().main_content()
+
+
+def extract_with_lxml(html: bytes, profile: str) -> str:
+    builder = BlockBuilder()
+    parser = lxml_etree.HTMLParser(target=builder, remove_comments=True)
+    parser.feed(html)
+    return parser.close().main_content()
+
+
+def extract_with_soup(html: bytes, profile: str) -> str:
+    from bs4 import BeautifulSoup  # Only the comparison backend needs bs4
+
+    soup = BeautifulSoup(html, "html.parser")
+    texts = soup.find_all(LEGACY_EXTRACTOR_TAGS[profile])
+    return " ".join([t.get_text() for t in texts])
+
+
+LEGACY_EXTRACTOR_TAGS = {
+    "webpage": ["p", "h1", "h2", "h3", "li"],
+    "news": ["p", "h1", "h2", "article", "section"],
+}
+ARTICLE_BACKENDS: dict[str, Callable[[bytes, str], str]] = {
+    "tokenizer": extract_with_tokenizer,
+    "legacy": extract_with_soup,
+}
+if lxml_etree is not None:
+    ARTICLE_BACKENDS["lxml"] = extract_with_lxml
+
+
+def resolve_article_backend(name: str = ARTICLE_BACKEND) -> str:
+    if name == "auto":
+        return "lxml" if "lxml" in ARTICLE_BACKENDS else "tokenizer"
+    if name not in ARTICLE_BACKENDS:
+        print(f"WARNING: Article backend '{name}' unavailable, using tokenizer.")
+        return "tokenizer"
+    return name
+
+
+def extract_article_text(html: bytes, profile: str, backend: str | None = None) -> str:
+    """Main text of a page. `profile` only changes the tag set of the legacy backend."""
+    return ARTICLE_BACKENDS[backend or resolve_article_backend()](html, profile)
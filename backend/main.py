@@ -1,37 +1,54 @@
 import os
+import sys
+import io
 import base64
-import requests
+import httpx
 import json
 import re
-import urllib3
 import time
 import urllib.parse
 import sqlite3
 import math
+import asyncio
+import hashlib
+import hmac
+import threading
+import string
+import heapq
+import importlib.util
+import multiprocessing
+from multiprocessing import shared_memory
+import random
+import secrets
+import socket
 from fastapi import FastAPI, HTTPException, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import google.generativeai as genai
-from apify_client import ApifyClient
-from groq import Groq
-from bs4 import BeautifulSoup
+from apify_client import ApifyClientAsync
+from groq import AsyncGroq
 from gtts import gTTS
-import tempfile
 from dotenv import load_dotenv
-import feedparser
 import yfinance as yf
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from lemonsqueezy import LemonSqueezy
 from datetime import datetime
-from typing import List, Any
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import List, Any, Awaitable, Callable
 
 load_dotenv()
 
 from supabase import create_client, Client
+from extraction import resolve_article_backend  # After load_dotenv: reads ARTICLE_BACKEND
+from cpu_tasks import call_with_shared_payload, extract_article_text, parse_feed_entries
 
 # Database Initialization (SQLite removed, using Supabase)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -85,14 +102,318 @@ PAYPAL_MODE = os.getenv("PAYPAL_MODE", "sandbox") # sandbox or live
 
 # Gistly URL for Redirects
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
-model = genai.GenerativeModel("gemini-flash-latest")
-apify_client = ApifyClient(APIFY_TOKEN) if APIFY_TOKEN else None
-groq_client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+# Externally visible origin of this API (e.g. https://api.gistly.app), used for
+# links handed back to clients; request.base_url is http:// behind Render's proxy
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+GEMINI_MODEL_NAME = "gemini-flash-latest"
+model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+apify_client = ApifyClientAsync(APIFY_TOKEN) if APIFY_TOKEN else None
+groq_client = AsyncGroq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+
+# Per-provider concurrency caps. Provider calls are awaited natively, so a
+# single worker can keep this many requests in flight per upstream.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "128"))
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "128"))
+gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+groq_slots = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+
+# Outbound HTTP: one pooled AsyncClient for every upstream call, opened at
+# startup and closed at shutdown. HTTP/2 is used when the optional `h2`
+# package is installed. httpx has no per-host cap, so one is layered on top,
+# along with retry/backoff for idempotent requests.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "50"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "32"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_RETRY_STATUSES = {429, 502, 503, 504}
+HTTP_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class HostSlot:
+    semaphore: asyncio.Semaphore
+    users: int = 0  # Requests waiting for or holding the semaphore
+    in_flight: int = 0
+
+
+class OutboundHTTP:
+    """Shared client with per-host concurrency limits and retry/backoff.
+
+    A host's slot exists only while requests to it are waiting or in flight,
+    so the table stays as small as the set of hosts currently being called.
+    """
+
+    def __init__(self):
+        self._client: httpx.AsyncClient | None = None
+        self.host_slots: dict[str, HostSlot] = {}
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                follow_redirects=True,
+                timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=30,
+                ),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError("Outbound HTTP client used outside the app lifespan.")
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self, url: str):
+        host = httpx.URL(url).host
+        slot = self.host_slots.get(host)
+        if slot is None:
+            slot = self.host_slots[host] = HostSlot(asyncio.Semaphore(HTTP_PER_HOST_LIMIT))
+        slot.users += 1
+        try:
+            async with slot.semaphore:
+                slot.in_flight += 1
+                try:
+                    yield
+                finally:
+                    slot.in_flight -= 1
+        finally:
+            slot.users -= 1
+            if not slot.users:
+                del self.host_slots[host]
+
+    @staticmethod
+    def _retry_delay(attempt: int, response: httpx.Response | None) -> float:
+        retry_after = response.headers.get("retry-after", "") if response is not None else ""
+        if retry_after.isdigit():
+            return min(float(retry_after), 10.0)
+        return HTTP_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+    async def request(self, method: str, url: str, retries: int | None = None, **kwargs: Any) -> httpx.Response:
+        """Send a request. Only idempotent methods are retried unless `retries` is given."""
+        method = method.upper()
+        if retries is None:
+            retries = HTTP_RETRIES if method in HTTP_IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            self.stats["requests"] += 1
+            try:
+                async with self._slot(url):
+                    response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if attempt >= retries:
+                    self.stats["errors"] += 1
+                    raise
+                response = None
+            else:
+                if response.status_code not in HTTP_RETRY_STATUSES or attempt >= retries:
+                    return response
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs: Any):
+        """Streamed response under the host limit; not retried, as the body is consumed live."""
+        self.stats["requests"] += 1
+        async with self._slot(url):
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            **self.stats,
+            "http2": HTTP2_AVAILABLE,
+            "hosts": len(self.host_slots),
+            "busy_hosts": {host: slot.in_flight for host, slot in self.host_slots.items() if slot.in_flight},
+            "waiting": sum(slot.users - slot.in_flight for slot in self.host_slots.values()),
+        }
+
+
+outbound = OutboundHTTP()
+
+
+# CPU-bound stages (HTML extraction, feed parsing) run in a process pool sized
+# to the cores this process may use, so they neither hold the event loop's GIL
+# nor serialise concurrent requests. Pool functions live in cpu_tasks.py, which
+# spawned workers can import without re-running this module. That only holds
+# when the app is served as `uvicorn main:app`: under `python main.py` this file
+# is __main__, spawn re-executes it in every worker, so the pool stays off and
+# work is offloaded to threads instead. Payloads above
+# CPU_SHM_THRESHOLD go through shared memory instead of the pickled pipe; the
+# worker still copies them out once, so this saves the pipe transfer, not the copy.
+# CPU_POOL_WORKERS=0 falls back to thread offload, for A/B runs against the
+# event-loop lag metrics.
+CPU_POOL_MAX_WORKERS = int(os.getenv("CPU_POOL_MAX_WORKERS", "8"))
+
+
+def usable_cpus() -> int:
+    # Affinity reflects container CPU pinning; cpu_count() reports the host's cores
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(usable_cpus(), CPU_POOL_MAX_WORKERS))))
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "spawn")
+CPU_SHM_THRESHOLD = int(os.getenv("CPU_SHM_THRESHOLD", str(256 * 1024)))
+
+
+def started_as_script() -> bool:
+    main_file = getattr(sys.modules.get("__main__"), "__file__", None)
+    return bool(main_file) and os.path.abspath(main_file) == os.path.abspath(__file__)
+
+
+class CPUPool:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor: ProcessPoolExecutor | None = None
+        self.stats = {"pool_calls": 0, "thread_calls": 0, "shared_memory_calls": 0, "errors": 0}
+
+    def start(self):
+        if self.workers > 0 and self.executor is None:
+            if started_as_script():
+                print("WARNING: CPU pool disabled under `python main.py`; serve with `uvicorn main:app` to enable it.")
+                self.workers = 0
+                return
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(CPU_POOL_START_METHOD)
+            )
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def run(self, fn: Callable[..., Any], payload: bytes, *args: Any) -> Any:
+        """Run `fn(payload, *args)` off the event loop; `fn` must be a module-level function."""
+        if self.executor is None:
+            self.stats["thread_calls"] += 1
+            return await asyncio.to_thread(fn, payload, *args)
+
+        loop = asyncio.get_running_loop()
+        self.stats["pool_calls"] += 1
+        try:
+            if len(payload) < CPU_SHM_THRESHOLD:
+                return await loop.run_in_executor(self.executor, fn, payload, *args)
+            block = shared_memory.SharedMemory(create=True, size=len(payload))
+            try:
+                block.buf[: len(payload)] = payload
+                self.stats["shared_memory_calls"] += 1
+                return await loop.run_in_executor(
+                    self.executor, call_with_shared_payload, fn, block.name, len(payload), *args
+                )
+            finally:
+                block.close()
+                block.unlink()
+        except BrokenProcessPool:
+            # A crashed worker poisons the pool; rebuild it and finish this call in a thread
+            self.stats["errors"] += 1
+            self.shutdown()
+            self.start()
+            return await asyncio.to_thread(fn, payload, *args)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**self.stats, "workers": self.workers if self.executor is not None else 0}
+
+
+cpu_pool = CPUPool(CPU_POOL_WORKERS)
+
+
+# Long-running maintenance loops (warm-ups, probers, workers) register here
+# and run for the lifetime of the app.
+background_services: list[Callable[[], Awaitable[None]]] = []
+
+
+def background_service(fn: Callable[[], Awaitable[None]]) -> Callable[[], Awaitable[None]]:
+    background_services.append(fn)
+    return fn
+
+
+BACKGROUND_RESTART_MAX_DELAY = float(os.getenv("BACKGROUND_RESTART_MAX_DELAY", "60"))
+
+
+async def run_background_service(fn: Callable[[], Awaitable[None]]) -> None:
+    # A crashed service is restarted with exponential backoff; returning ends it
+    delay = 1.0
+    while True:
+        try:
+            await fn()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Background service {fn.__name__} crashed, restarting in {delay:.0f}s: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BACKGROUND_RESTART_MAX_DELAY)
+
+
+# Event-loop lag: how late a short sleep wakes up. Anything blocking the loop
+# (inline parsing, encoding, sync I/O) shows up here directly.
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "240"))
+loop_lag_samples: deque[float] = deque(maxlen=LOOP_LAG_WINDOW)
+
+
+@background_service
+async def loop_lag_monitor() -> None:
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag_samples.append(max(time.monotonic() - started - LOOP_LAG_INTERVAL, 0.0))
+
+
+def loop_lag_snapshot() -> dict[str, Any]:
+    if not loop_lag_samples:
+        return {"samples": 0}
+    ordered = sorted(loop_lag_samples)
+    return {
+        "samples": len(ordered),
+        "avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p99_ms": round(ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)] * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await outbound.start()
+    cpu_pool.start()
+    tasks = [asyncio.create_task(run_background_service(fn)) for fn in background_services]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await outbound.close()
+        cpu_pool.shutdown()
+
 
 app = FastAPI(
     title="Gistly Multi-Tool API",
     description="Backend for Gistly AI's suite of developer and creator tools.",
     version="2.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware - Hardened to trusted origins
@@ -115,6 +436,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*", "X-Nexus-Shield", "X-API-KEY"],
+    expose_headers=["X-Text-Response", "X-Detected-Lang", "X-Engine", "X-Confidence", "X-Image-Url", "ETag"],
 )
 
 # Nexus Shield: Core Security Middleware
@@ -129,6 +451,10 @@ async def nexus_security_shield(request: Request, call_next):
     public_paths = ["/", "/api/marketplace/plans", "/docs", "/openapi.json"]
     if request.url.path in public_paths:
         return await call_next(request)
+
+    # Signed image links are loaded straight by <img> tags; the signature is the check
+    if request.url.path.startswith("/api/images/"):
+        return await call_next(request)
     
     # Internal Frontend Verification
     shield = request.headers.get("X-Nexus-Shield")
@@ -147,6 +473,25 @@ async def nexus_security_shield(request: Request, call_next):
         content={"detail": "Nexus Shield: Forbidden Access. Origin not verified."}
     )
 
+@app.middleware("http")
+async def cache_control_context(request: Request, call_next):
+    # Clients can force a fresh AI answer with `X-Cache-Bypass: 1`
+    bypass = request.headers.get(AI_CACHE_BYPASS_HEADER, "").lower() in ("1", "true", "yes")
+    token = cache_bypass.set(bypass)
+    try:
+        return await call_next(request)
+    finally:
+        cache_bypass.reset(token)
+
+@app.middleware("http")
+async def request_priority_context(request: Request, call_next):
+    # Only the key is recorded; its plan is looked up when an AI call needs admission
+    token = request_api_key.set(request.headers.get("X-API-KEY"))
+    try:
+        return await call_next(request)
+    finally:
+        request_api_key.reset(token)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
@@ -165,565 +510,3316 @@ class AdminLogin(BaseModel):
     password: str
 
 
-# --- Telemetry & Analytics Core ---
-global_stats: dict[str, Any] = {
-    "visitors": [],
-    "workflows_count": 0,
-    "api_keys_active": 18,  # Mocked active keys
-    "revenue_est": 2450.00
-}
+class CustomerRequest(BaseModel):
+    name: str
+    email: str
+    request_type: str
+    details: str
+
+
+class VisitorTrack(BaseModel):
+    ip: str = "unknown"
+    country: str = "unknown"
+    city: str = "unknown"
+    path: str = "/"
+
+class APIKeyCreate(BaseModel):
+    user_email: str
+    plan: str = "free"  # free, pro, enterprise
+
+class APIKeyStatus(BaseModel):
+    api_key: str
+
+
+@app.get("/")
+async def status():
+    return {"status": "online", "model": "gemini-1.5-pro"}
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Operational counters for the AI serving layer."""
+    return {
+        "ai_cache": ai_cache.snapshot(),
+        "coalescing": {f.name: f.snapshot() for f in (ai_flights, scrape_flights, image_flights, tts_flights)},
+        "near_duplicate_cache": near_dup_cache.snapshot(),
+        "admission": {name: sched.snapshot() for name, sched in provider_admission.items()},
+        "image_store": image_store.snapshot(),
+        "hf_health": hf_health.snapshot(),
+        "jobs": job_queue.snapshot(),
+        "tts_cache": speech_cache.snapshot(),
+        "voice_assistant": voice_metrics_snapshot(),
+        "outbound_http": outbound.snapshot(),
+        "article_store": article_store.snapshot(),
+        "cpu_pool": cpu_pool.snapshot(),
+        "youtube_transcripts": transcript_cache.snapshot(),
+        "event_loop": loop_lag_snapshot(),
+        "tools": tool_metrics_snapshot(),
+    }
+
+
+# --- AI Response Cache ---
+# Two tiers: an in-process LRU in front of a SQLite store in WAL mode, so
+# answers survive restarts and are shared by every uvicorn worker on the host.
+DATA_DIR = os.getenv(
+    "GISTLY_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+AI_CACHE_DB = os.getenv("AI_CACHE_DB", os.path.join(DATA_DIR, "ai_cache.sqlite3"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "86400"))
+AI_CACHE_MEMORY_ENTRIES = int(os.getenv("AI_CACHE_MEMORY_ENTRIES", "1024"))
+AI_CACHE_DISK_ENTRIES = int(os.getenv("AI_CACHE_DISK_ENTRIES", "50000"))
+AI_CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+cache_bypass: ContextVar[bool] = ContextVar("cache_bypass", default=False)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so trivially different pastes share a cache key."""
+    return " ".join(prompt.split())
+
+
+class ResponseCache:
+    """LRU + TTL cache of AI answers backed by SQLite."""
+
+    def __init__(self, path: str, ttl: int, memory_entries: int, disk_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._writes_since_trim = 0
+
+    @staticmethod
+    def make_key(tool: str, prompt: str, model_name: str) -> str:
+        raw = f"{tool}\x00{model_name}\x00{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "key TEXT PRIMARY KEY, tool TEXT, value TEXT, "
+                "expires_at REAL, accessed_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ai_cache_accessed ON ai_cache(accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self.memory[key] = (value, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> tuple[str, float] | None:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, expires_at FROM ai_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            if row[1] < now:
+                db.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE ai_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            return row[0], row[1]
+
+    def _disk_set(self, key: str, tool: str, value: str, expires_at: float):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, tool, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, tool, value, expires_at, now),
+            )
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 100:
+                self._writes_since_trim = 0
+                self._trim(db, now)
+            db.commit()
+
+    def _trim(self, db: sqlite3.Connection, now: float):
+        removed = db.execute("DELETE FROM ai_cache WHERE expires_at < ?", (now,)).rowcount
+        overflow = db.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0] - self.disk_entries
+        if overflow > 0:
+            removed += db.execute(
+                "DELETE FROM ai_cache WHERE key IN "
+                "(SELECT key FROM ai_cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        self.stats["evictions"] += max(removed, 0)
+
+    async def get(self, key: str) -> str | None:
+        cached = self.memory.get(key)
+        if cached and cached[1] >= time.time():
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return cached[0]
+        try:
+            row = await asyncio.to_thread(self._disk_get, key)
+        except Exception as e:
+            print(f"AI cache read error: {e}")
+            row = None
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self._remember(key, row[0], row[1])
+        self.stats["disk_hits"] += 1
+        return row[0]
+
+    async def set(self, key: str, tool: str, value: str, ttl: int | None = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+        self.stats["writes"] += 1
+        try:
+            await asyncio.to_thread(self._disk_set, key, tool, value, expires_at)
+        except Exception as e:
+            print(f"AI cache write error: {e}")
+
+    def snapshot(self) -> dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self.memory),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+ai_cache = ResponseCache(AI_CACHE_DB, AI_CACHE_TTL, AI_CACHE_MEMORY_ENTRIES, AI_CACHE_DISK_ENTRIES)
+
+
+# --- Request Coalescing ---
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one computation.
+
+    The first caller for a key starts the work; callers arriving while it is
+    in flight await the same task and receive its result or its exception.
+    The key is released as soon as the task settles, so nothing is pinned.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.inflight: dict[str, asyncio.Future] = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    async def do(self, key: str, factory):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._release(k, t))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["followers"] += 1
+        # Shielded so one disconnecting client cannot cancel everyone's result
+        return await asyncio.shield(task)
+
+    def _release(self, key: str, task: asyncio.Future):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when every waiter has gone
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**self.stats, "in_flight": len(self.inflight)}
+
+
+def flight_key(tool: str, *parts: str) -> str:
+    raw = "\x00".join([tool, *(normalize_prompt(p) for p in parts)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+ai_flights = SingleFlight("ai")
+scrape_flights = SingleFlight("scrape")
+image_flights = SingleFlight("image")
+
+
+# --- Near-Duplicate Cache ---
+# MinHash signatures over word shingles, bucketed with LSH bands, let prompts
+# that differ only by whitespace, tracking junk or a trailing sentence reuse
+# a stored answer. Everything is computed locally; nothing leaves the process.
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "5000"))
+NEAR_DUP_MIN_WORDS = int(os.getenv("NEAR_DUP_MIN_WORDS", "40"))
+NEAR_DUP_SHINGLE_WORDS = 5
+NEAR_DUP_PERMUTATIONS = 64
+NEAR_DUP_BANDS = 16  # 4 rows per band: candidates from roughly 50% similarity
+NEAR_DUP_MAX_SHINGLES = 4096  # Bottom-k sample keeps huge pages cheap to sign
+MERSENNE_PRIME = (1 << 61) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _minhash_permutations(count: int) -> list[tuple[int, int]]:
+    # Deterministic so signatures stay comparable across restarts and workers
+    seeds = hashlib.sha256(b"gistly-minhash").digest()
+    perms = []
+    for i in range(count):
+        digest = hashlib.blake2b(seeds + i.to_bytes(2, "big"), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "big") % MERSENNE_PRIME or 1
+        b = int.from_bytes(digest[8:], "big") % MERSENNE_PRIME
+        perms.append((a, b))
+    return perms
+
+
+MINHASH_PERMUTATIONS = _minhash_permutations(NEAR_DUP_PERMUTATIONS)
+
+
+def minhash_signature(text: str) -> tuple[int, ...] | None:
+    """MinHash of the text's word shingles, or None if it is too short to compare."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < NEAR_DUP_MIN_WORDS:
+        return None
+    shingles = {
+        int.from_bytes(
+            hashlib.blake2b(
+                " ".join(words[i:i + NEAR_DUP_SHINGLE_WORDS]).encode("utf-8"), digest_size=8
+            ).digest(),
+            "big",
+        )
+        for i in range(len(words) - NEAR_DUP_SHINGLE_WORDS + 1)
+    }
+    if len(shingles) > NEAR_DUP_MAX_SHINGLES:
+        shingles = set(sorted(shingles)[:NEAR_DUP_MAX_SHINGLES])
+    return tuple(
+        min((a * h + b) % MERSENNE_PRIME for h in shingles) for a, b in MINHASH_PERMUTATIONS
+    )
+
+
+class NearDuplicateCache:
+    """In-memory LSH index of answers keyed by MinHash signature, per tool."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.rows = NEAR_DUP_PERMUTATIONS // NEAR_DUP_BANDS
+        self.entries: OrderedDict[int, tuple[str, tuple[int, ...], str, float]] = OrderedDict()
+        self.buckets: dict[tuple[str, int, int], set[int]] = {}
+        self.next_id = 0
+        self.stats = {"hits": 0, "misses": 0, "inserts": 0}
+
+    def _bands(self, signature: tuple[int, ...]):
+        for band in range(NEAR_DUP_BANDS):
+            yield band, hash(signature[band * self.rows:(band + 1) * self.rows])
+
+    def lookup(self, tool: str, signature: tuple[int, ...], threshold: float) -> str | None:
+        now = time.time()
+        candidates: set[int] = set()
+        for band, band_hash in self._bands(signature):
+            candidates |= self.buckets.get((tool, band, band_hash), set())
+        best: tuple[float, int] | None = None
+        for entry_id in candidates:
+            _, other, _, expires_at = self.entries[entry_id]
+            if expires_at < now:
+                continue
+            similarity = sum(x == y for x, y in zip(signature, other)) / NEAR_DUP_PERMUTATIONS
+            if similarity >= threshold and (best is None or similarity > best[0]):
+                best = (similarity, entry_id)
+        if best is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(best[1])
+        self.stats["hits"] += 1
+        return self.entries[best[1]][2]
+
+    def insert(self, tool: str, signature: tuple[int, ...], answer: str, ttl: int):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = (tool, signature, answer, time.time() + ttl)
+        for band, band_hash in self._bands(signature):
+            self.buckets.setdefault((tool, band, band_hash), set()).add(entry_id)
+        self.stats["inserts"] += 1
+        while len(self.entries) > self.max_entries:
+            self._evict(*self.entries.popitem(last=False))
+
+    def _evict(self, entry_id: int, entry: tuple[str, tuple[int, ...], str, float]):
+        tool, signature = entry[0], entry[1]
+        for band, band_hash in self._bands(signature):
+            bucket = self.buckets.get((tool, band, band_hash))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.buckets[(tool, band, band_hash)]
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**self.stats, "entries": len(self.entries)}
+
+
+near_dup_cache = NearDuplicateCache(NEAR_DUP_MAX_ENTRIES)
+
+
+# --- Tool Registry ---
+# Every AI tool declares its serving policy here: prompt template, model tier,
+# output cap, cache TTL, timeout and hedging. Tools with a template are also
+# served by the generic /api/tools/{tool} dispatcher and their legacy route.
+GEMINI_QUALITY_MODEL_NAME = os.getenv("GEMINI_QUALITY_MODEL", "gemini-pro-latest")
+GEMINI_LITE_MODEL_NAME = os.getenv("GEMINI_LITE_MODEL", "gemini-flash-lite-latest")
+MODEL_TIERS: dict[str, dict[str, str]] = {
+    "lite": {"gemini": GEMINI_LITE_MODEL_NAME, "groq": "llama3-8b-8192"},
+    "fast": {"gemini": GEMINI_MODEL_NAME, "groq": "llama3-8b-8192"},
+    "quality": {"gemini": GEMINI_QUALITY_MODEL_NAME, "groq": "llama3-70b-8192"},
+}
+gemini_models: dict[str, Any] = {GEMINI_MODEL_NAME: model}
+
+
+def gemini_model_for(name: str):
+    if name not in gemini_models:
+        gemini_models[name] = genai.GenerativeModel(name)
+    return gemini_models[name]
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    """Serving policy for one AI tool."""
+
+    name: str
+    template: str | None = None  # Prompt with {content} / {context} slots
+    route: str | None = None  # Legacy POST /api/<route> alias
+    tier: str = "fast"
+    max_output_tokens: int | None = None  # None leaves the provider's own limit in place
+    cache_ttl: int = AI_CACHE_TTL  # Seconds; 0 disables caching
+    timeout: float = 60.0
+    hedge: bool = False
+    near_dup_threshold: float | None = None  # MinHash similarity; None = exact matches only
+    compiled: tuple = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Parse the template once so rendering is a plain join
+        pieces: list[tuple[str, str | None]] = []
+        if self.template is not None:
+            for literal, slot, _, _ in string.Formatter().parse(self.template):
+                if literal:
+                    pieces.append((literal, None))
+                if slot is not None:
+                    pieces.append(("", slot))
+        object.__setattr__(self, "compiled", tuple(pieces))
+
+    @property
+    def gemini_model_name(self) -> str:
+        return MODEL_TIERS[self.tier]["gemini"]
+
+    @property
+    def groq_model_name(self) -> str:
+        return MODEL_TIERS[self.tier]["groq"]
+
+    @property
+    def gemini_generation_config(self) -> dict[str, int]:
+        return {"max_output_tokens": self.max_output_tokens} if self.max_output_tokens else {}
+
+    @property
+    def groq_limits(self) -> dict[str, int]:
+        return {"max_tokens": self.max_output_tokens} if self.max_output_tokens else {}
+
+    def render(self, req: AIRequest) -> str:
+        values = {"content": req.content, "context": req.context}
+        return "".join(literal if slot is None else values[slot] for literal, slot in self.compiled)
+
+
+TOOL_REGISTRY: dict[str, ToolSpec] = {
+    spec.name: spec
+    for spec in [
+        ToolSpec(
+            "summarize",
+            route="summarize",
+            hedge=True,
+            near_dup_threshold=0.9,
+            template="Summarize the following text concisely. Focus on the key takeaways:\n\n{content}",
+        ),
+        ToolSpec(
+            "debug",
+            route="debug",
+            hedge=True,
+            template=(
+                "Identify bugs and provide a fix for the following code. "
+                "Explain why the bug occurred.\n\nCode:\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "humanize",
+            route="humanize",
+            hedge=True,
+            template=(
+                "Rewrite the following text to sound more natural, human, and conversational. "
+                "Avoid generic AI patterns while maintaining the original meaning:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "resume-optimize",
+            route="resume-optimize",
+            template=(
+                "Analyze this resume content and suggest optimizations for ATS (Applicant Tracking Systems). "
+                "Highlight keyword improvements and formatting suggestions:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "sql-generate",
+            route="sql-generate",
+            hedge=True,
+            template=(
+                "Generate a well-optimized SQL query based on this natural language description. "
+                "Assume standard relational database schemas:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "social-post",
+            route="social-post",
+            cache_ttl=3600,
+            template=(
+                "Generate highly engaging social media posts for Twitter, LinkedIn, and Instagram "
+                "based on this topic or content:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "email-gen",
+            route="email-gen",
+            hedge=True,
+            cache_ttl=3600,
+            template=(
+                "Write a professional and highly effective email based on the following context. "
+                "Ensure the tone is appropriate for a business setting:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "regex-gen",
+            route="regex-gen",
+            hedge=True,
+            template=(
+                "Create a Regular Expression (Regex) for the following natural language description. "
+                "Provide the regex pattern and a brief explanation of how it works:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "cover-letter",
+            route="cover-letter",
+            cache_ttl=3600,
+            template=(
+                "Write a compelling and professional cover letter based on the following details "
+                "(job description, personal experience, etc.). Highlight key strengths:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "grammar-fix",
+            route="grammar-fix",
+            hedge=True,
+            template=(
+                "Act as a professional proofreader. Fix any grammar, spelling, or punctuation errors "
+                "in the following text. Also, suggest improvements to make it sound more professional:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "business-validator",
+            route="business-validator",
+            tier="quality",
+            max_output_tokens=8192,
+            timeout=90.0,
+            template=(
+                "Act as an expert startup advisor. Analyze the following business idea. "
+                "Provide a structured report including: 1) Pros, 2) Cons, 3) Target Audience, "
+                "and 4) Competitive Analysis:\n\n{content}"
+            ),
+        ),
+        ToolSpec(
+            "blog-gen",
+            route="blog-gen",
+            max_output_tokens=8192,
+            timeout=90.0,
+            cache_ttl=3600,
+            template=(
+                "Write a comprehensive, engaging, and SEO-optimized blog post based on the following topic or outline. "
+                "Include an engaging title, introduction, body paragraphs with headings, and a conclusion:\n\n{content}"
+            ),
+        ),
+        # Placeholder until the Vision tool accepts image uploads or base64 data
+        ToolSpec(
+            "vision",
+            route="vision",
+            template=(
+                "You are given an image. Please describe what is in the main focus of the scene. "
+                "Context provided by user: {content}"
+            ),
+        ),
+        ToolSpec(
+            "scores-predict",
+            route="scores/predict",
+            hedge=True,
+            cache_ttl=60,  # Live match context goes stale quickly
+            max_output_tokens=1024,
+            template=(
+                "You are an expert sports analyst AI for Gistly.site. Calculate the approximate live winning probability for this match "
+                "based on the current live match context. "
+                "Provide a short 2-3 sentence analysis of the situation and explicitly state the winning percentages for both teams.\n\n"
+                "Match Context:\n{content}\n"
+            ),
+        ),
+        # Composite tools build their own prompts; only their policy lives here
+        ToolSpec("youtube-summarizer", timeout=90.0, near_dup_threshold=0.9),
+        ToolSpec("webpage-summarizer", timeout=90.0, near_dup_threshold=0.85),
+        ToolSpec("news-summarize", timeout=90.0, near_dup_threshold=0.85),
+        ToolSpec("webpage-digest", timeout=90.0),
+        ToolSpec("markets-analyze", cache_ttl=300),
+        ToolSpec("image-prompt", tier="lite", hedge=True, max_output_tokens=1024),
+        ToolSpec("voice-assistant", tier="lite", hedge=True, max_output_tokens=512),
+        ToolSpec("voice-clone", max_output_tokens=2048),
+    ]
+}
+DEFAULT_TOOL_SPEC = ToolSpec("default")
+
+
+def resolve_tool_spec(tool: str | None) -> ToolSpec:
+    """Registry entry for a tool; pipeline stages like `x:map` inherit from `x`."""
+    if not tool:
+        return DEFAULT_TOOL_SPEC
+    return TOOL_REGISTRY.get(tool) or TOOL_REGISTRY.get(tool.split(":", 1)[0], DEFAULT_TOOL_SPEC)
+
+
+tool_metrics: dict[str, dict[str, float]] = {}
+
+
+def record_tool_call(tool: str, latency: float, cache_hit: bool = False, error: bool = False):
+    metrics = tool_metrics.setdefault(
+        tool, {"calls": 0, "cache_hits": 0, "errors": 0, "latency_total": 0.0}
+    )
+    metrics["calls"] += 1
+    metrics["cache_hits"] += int(cache_hit)
+    metrics["errors"] += int(error)
+    metrics["latency_total"] += latency
+
+
+def tool_metrics_snapshot() -> dict[str, Any]:
+    return {
+        tool: {
+            "calls": int(m["calls"]),
+            "cache_hits": int(m["cache_hits"]),
+            "errors": int(m["errors"]),
+            "avg_latency": round(m["latency_total"] / m["calls"], 3) if m["calls"] else 0.0,
+        }
+        for tool, m in tool_metrics.items()
+    }
+
+
+# --- Provider Admission Control ---
+# Each provider gets token buckets sized to its RPM/TPM quota. Callers that
+# would burst past the quota wait in a priority queue (enterprise, then pro,
+# then free) until capacity refills or their deadline passes, instead of
+# failing straight through to a 500.
+PROVIDER_QUOTAS: dict[str, dict[str, int]] = {
+    "Gemini": {
+        "rpm": int(os.getenv("GEMINI_RPM", "1000")),
+        "tpm": int(os.getenv("GEMINI_TPM", "1000000")),
+    },
+    "Groq": {
+        "rpm": int(os.getenv("GROQ_RPM", "30")),
+        "tpm": int(os.getenv("GROQ_TPM", "30000")),
+    },
+}
+PLAN_PRIORITY = {"enterprise": 0, "pro": 1, "free": 2}
+AI_ADMISSION_MAX_WAIT = float(os.getenv("AI_ADMISSION_MAX_WAIT", "20"))
+request_api_key: ContextVar[str | None] = ContextVar("request_api_key", default=None)
+request_plan: ContextVar[str | None] = ContextVar("request_plan", default=None)  # Set explicitly by job workers
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.per_second
+
+
+class ProviderScheduler:
+    """Token-bucket admission for one provider with a priority wait queue."""
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.waiters: list[list[Any]] = []  # Heap of [priority, seq, future, cost]
+        self.seq = 0
+        self.pump: asyncio.Task | None = None
+        self.waits: deque[float] = deque(maxlen=1000)
+        self.stats = {"admitted": 0, "queued": 0, "timed_out": 0}
+
+    def _try_take(self, cost: float) -> bool:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        cost = min(cost, self.tokens.capacity)
+        if self.requests.level >= 1 and self.tokens.level >= cost:
+            self.requests.level -= 1
+            self.tokens.level -= cost
+            return True
+        return False
+
+    async def acquire(self, cost: float, priority: int, deadline: float):
+        start_time = time.monotonic()
+        if not self.waiters and self._try_take(cost):
+            self.stats["admitted"] += 1
+            self.waits.append(0.0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.waiters, [priority, self.seq, future, cost])
+        self.stats["queued"] += 1
+        if self.pump is None or self.pump.done():
+            self.pump = asyncio.create_task(self._drain())
+        try:
+            await asyncio.wait_for(future, timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.stats["timed_out"] += 1
+            raise AdmissionTimeout(
+                f"{self.name} quota saturated; waited {time.monotonic() - start_time:.1f}s"
+            )
+        self.stats["admitted"] += 1
+        self.waits.append(time.monotonic() - start_time)
+
+    async def _drain(self):
+        while self.waiters:
+            _, _, future, cost = self.waiters[0]
+            if future.done():  # Timed out or cancelled while queued
+                heapq.heappop(self.waiters)
+                continue
+            if self._try_take(cost):
+                heapq.heappop(self.waiters)
+                future.set_result(None)
+                continue
+            await asyncio.sleep(
+                max(self.requests.seconds_until(1), self.tokens.seconds_until(cost), 0.01)
+            )
+
+    def snapshot(self) -> dict[str, Any]:
+        waits = sorted(self.waits)
+        return {
+            **self.stats,
+            "queue_depth": sum(1 for w in self.waiters if not w[2].done()),
+            "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "p95_wait": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "max_wait": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+provider_admission = {
+    name: ProviderScheduler(name, quota["rpm"], quota["tpm"])
+    for name, quota in PROVIDER_QUOTAS.items()
+}
+
+
+ADMISSION_DEFAULT_OUTPUT_TOKENS = 2048  # Assumed output for uncapped tools
+
+
+def estimate_tokens(prompt: str, max_output_tokens: int | None) -> int:
+    """Rough TPM cost: ~4 characters per prompt token plus a share of the output cap."""
+    return len(prompt) // 4 + (max_output_tokens or ADMISSION_DEFAULT_OUTPUT_TOKENS) // 4
+
+
+async def admit(provider: str, prompt: str, max_output_tokens: int | None):
+    """Wait for quota on `provider`, ordered by the caller's plan."""
+    priority = PLAN_PRIORITY.get(await current_plan(), PLAN_PRIORITY["free"])
+    await provider_admission[provider].acquire(
+        estimate_tokens(prompt, max_output_tokens),
+        priority,
+        time.monotonic() + AI_ADMISSION_MAX_WAIT,
+    )
+
+
+API_PLAN_CACHE_TTL = 300
+API_PLAN_CACHE_ENTRIES = int(os.getenv("API_PLAN_CACHE_ENTRIES", "4096"))
+api_key_plans: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+
+def lookup_api_key_plan(api_key: str) -> str:
+    if not supabase:
+        return "free"
+    res = supabase.table("api_keys").select("plan").eq("api_key", api_key).eq("is_active", True).execute()
+    if not res.data:
+        return "free"
+    return res.data[0].get("plan") or "free"
+
+
+async def resolve_api_key_plan(api_key: str) -> str:
+    """Plan of an API key from the api_keys table, memoized for a few minutes in a bounded LRU."""
+    cached = api_key_plans.get(api_key)
+    if cached:
+        if cached[1] > time.time():
+            api_key_plans.move_to_end(api_key)
+            return cached[0]
+        del api_key_plans[api_key]
+    try:
+        plan = await asyncio.to_thread(lookup_api_key_plan, api_key)
+    except Exception as e:
+        print(f"Plan lookup failed: {e}")
+        plan = "free"
+    api_key_plans[api_key] = (plan, time.time() + API_PLAN_CACHE_TTL)
+    while len(api_key_plans) > API_PLAN_CACHE_ENTRIES:
+        api_key_plans.popitem(last=False)
+    return plan
+
+
+async def current_plan() -> str:
+    """Plan the current request or job is scheduled under; unknown keys count as free."""
+    plan = request_plan.get()
+    if plan:
+        return plan
+    api_key = request_api_key.get()
+    return await resolve_api_key_plan(api_key) if api_key else "free"
+
+
+# --- Provider Hedging ---
+# When a hedged tool's primary provider is slower than its recent latency
+# percentile, the next provider is fired in parallel and the first answer wins.
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "0.95"))
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "4.0"))
+AI_HEDGE_MIN_SAMPLES = 20
+# Comma-separated tool names; when set it replaces the registry's hedge flags
+HEDGED_TOOLS_OVERRIDE = (
+    {t.strip() for t in os.environ["AI_HEDGED_TOOLS"].split(",") if t.strip()}
+    if os.getenv("AI_HEDGED_TOOLS") is not None
+    else None
+)
+provider_latencies: dict[str, deque[float]] = {
+    "Gemini": deque(maxlen=500),
+    "Groq": deque(maxlen=500),
+}
+
+
+def should_hedge(tool: str | None, spec: ToolSpec) -> bool:
+    if HEDGED_TOOLS_OVERRIDE is not None:
+        return tool in HEDGED_TOOLS_OVERRIDE
+    return spec.hedge
+
+
+def hedge_delay(provider: str) -> float:
+    """Seconds to wait on `provider` before hedging, from its latency history."""
+    samples = sorted(provider_latencies.get(provider, ()))
+    if len(samples) < AI_HEDGE_MIN_SAMPLES:
+        return AI_HEDGE_DEFAULT_DELAY
+    index = min(len(samples) - 1, int(len(samples) * AI_HEDGE_PERCENTILE))
+    return samples[index]
+
+
+PRIMARY_PROVIDER = "Gemini"
+
+
+async def ask_gemini(prompt: str, spec: ToolSpec = DEFAULT_TOOL_SPEC):
+    """Internal function to call Gemini API."""
+    if not API_KEY:
+        raise Exception("Gemini API Key is not configured.")
+    async with gemini_slots:
+        response = await gemini_model_for(spec.gemini_model_name).generate_content_async(
+            prompt, generation_config=spec.gemini_generation_config
+        )
+    if not response.text:
+        raise Exception("Gemini returned an empty response.")
+    return response.text
+
+
+async def ask_groq(prompt: str, spec: ToolSpec = DEFAULT_TOOL_SPEC):
+    """Internal function to call Groq API (Fallback)."""
+    if not groq_client:
+        raise Exception("Groq API Key is not configured.")
+    async with groq_slots:
+        completion = await groq_client.chat.completions.create(
+            model=spec.groq_model_name,
+            messages=[{"role": "user", "content": prompt}],
+            **spec.groq_limits,
+        )
+    return completion.choices[0].message.content
+
+
+async def timed_provider_call(name: str, call, prompt: str, spec: ToolSpec):
+    """Run a provider call under the tool's timeout and record its latency.
+
+    Admission happens first, so queueing for quota neither eats into the
+    timeout nor skews the latency samples used for hedging.
+    """
+    await admit(name, prompt, spec.max_output_tokens)
+    start_time = time.monotonic()
+    try:
+        result = await asyncio.wait_for(call(prompt, spec), timeout=spec.timeout)
+    except asyncio.TimeoutError:
+        raise Exception(f"timed out after {spec.timeout:.0f}s")
+    provider_latencies[name].append(time.monotonic() - start_time)
+    return result
+
+
+async def hedged_ai_response(prompt: str, providers: list, errors: list[str], spec: ToolSpec):
+    """Race providers in order, launching the next one when the last is slow."""
+    queue = list(providers)
+    pending: dict[asyncio.Task, str] = {}
+
+    def launch():
+        name, call = queue.pop(0)
+        pending[asyncio.create_task(timed_provider_call(name, call, prompt, spec))] = name
+        return name
+
+    last_launched = launch()
+    try:
+        while pending:
+            timeout = hedge_delay(last_launched) if queue else None
+            done, _ = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                print(f"Hedging: {last_launched} exceeded {timeout:.2f}s, firing {queue[0][0]}...")
+                last_launched = launch()
+                continue
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    return task.result(), name
+                except Exception as e:
+                    error_msg = f"{name} failed: {str(e)}"
+                    print(error_msg)
+                    errors.append(error_msg)
+            if not pending and queue:
+                last_launched = launch()
+    finally:
+        for task in pending:
+            task.cancel()
+    return None
+
+
+async def generate_ai_response(prompt: str, tool: str | None = None, content: str | None = None):
+    """Unified AI interface with automatic fallback across providers.
+
+    The tool's registry entry picks the model tier, output cap, timeout,
+    cache TTL and whether a slow primary is hedged with the next provider.
+    Identical concurrent prompts share one provider call. Tools with a
+    near-duplicate threshold also reuse answers for similar `content`
+    (the user's input, defaulting to the whole prompt).
+    """
+    spec = resolve_tool_spec(tool)
+    start_time = time.monotonic()
+    cache_hit = False
+    failed = False
+    try:
+        key = ResponseCache.make_key(tool or spec.name, prompt, spec.gemini_model_name)
+        use_cache = bool(tool) and spec.cache_ttl > 0
+        bypass = cache_bypass.get()
+        if use_cache and not bypass:
+            cached = await ai_cache.get(key)
+            if cached is not None:
+                cache_hit = True
+                return cached
+
+        signature = None
+        if use_cache and spec.near_dup_threshold is not None:
+            signature = await asyncio.to_thread(
+                minhash_signature, prompt if content is None else content
+            )
+            if signature and not bypass:
+                similar = near_dup_cache.lookup(tool, signature, spec.near_dup_threshold)
+                if similar is not None:
+                    cache_hit = True
+                    return similar
+
+        async def compute():
+            result, provider = await ask_providers(prompt, tool, spec)
+            # The key names the primary's model, so fallback answers are not stored under it
+            if use_cache and provider == PRIMARY_PROVIDER:
+                await ai_cache.set(key, tool or spec.name, result, ttl=spec.cache_ttl)
+                if signature:
+                    near_dup_cache.insert(tool, signature, result, spec.cache_ttl)
+            return result
+
+        return await ai_flights.do(key, compute)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        if tool:
+            record_tool_call(tool, time.monotonic() - start_time, cache_hit=cache_hit, error=failed)
+
+
+async def ask_providers(prompt: str, tool: str | None = None, spec: ToolSpec = DEFAULT_TOOL_SPEC):
+    """Query the providers in priority order, hedging when the tool allows it.
+
+    Returns `(answer, provider_name)`.
+    """
+    errors: list[str] = []
+    providers = [("Gemini", ask_gemini)]
+    if groq_client:
+        providers.append(("Groq", ask_groq))
+
+    if should_hedge(tool, spec) and len(providers) > 1:
+        result = await hedged_ai_response(prompt, providers, errors, spec)
+        if result is not None:
+            return result
+    else:
+        for name, call in providers:
+            try:
+                if name != "Gemini":
+                    print(f"Attempting fallback to {name}...")
+                return await timed_provider_call(name, call, prompt, spec), name
+            except Exception as e:
+                error_msg = f"{name} failed: {str(e)}"
+                print(error_msg)
+                errors.append(error_msg)
+
+    # If all providers fail
+    raise HTTPException(
+        status_code=500,
+        detail=f"All AI providers failed. Diagnostics: {'; '.join(errors)}",
+    )
+
+
+# --- Streaming Generation ---
+async def stream_gemini(prompt: str, spec: ToolSpec = DEFAULT_TOOL_SPEC):
+    """Yield Gemini output chunks as they are generated."""
+    if not API_KEY:
+        raise Exception("Gemini API Key is not configured.")
+    emitted = False
+    await admit("Gemini", prompt, spec.max_output_tokens)
+    async with gemini_slots:
+        response = await gemini_model_for(spec.gemini_model_name).generate_content_async(
+            prompt,
+            generation_config=spec.gemini_generation_config,
+            stream=True,
+        )
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks carrying only finish/safety metadata have no text
+                continue
+            if text:
+                emitted = True
+                yield text
+    if not emitted:
+        raise Exception("Gemini returned an empty response.")
+
+
+async def stream_groq(prompt: str, spec: ToolSpec = DEFAULT_TOOL_SPEC):
+    """Yield Groq output chunks as they are generated."""
+    if not groq_client:
+        raise Exception("Groq API Key is not configured.")
+    await admit("Groq", prompt, spec.max_output_tokens)
+    async with groq_slots:
+        stream = await groq_client.chat.completions.create(
+            model=spec.groq_model_name,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            **spec.groq_limits,
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+async def stream_ai_response(prompt: str, tool: str | None = None):
+    """Streaming counterpart of generate_ai_response.
+
+    Yields `(event, payload)` pairs: `token` for each text chunk, `fallback`
+    when a provider dies and the next one restarts the answer (clients should
+    discard the partial text), then `done`. Raises HTTPException if every
+    provider fails.
+    """
+    spec = resolve_tool_spec(tool)
+    use_cache = bool(tool) and spec.cache_ttl > 0
+    cache_key = ResponseCache.make_key(tool, prompt, spec.gemini_model_name) if use_cache else None
+    if cache_key and not cache_bypass.get():
+        cached = await ai_cache.get(cache_key)
+        if cached is not None:
+            yield "token", {"text": cached}
+            yield "done", {"provider": "cache", "first_token_latency": 0.0}
+            return
+
+    providers = [("Gemini", stream_gemini)]
+    if groq_client:
+        providers.append(("Groq", stream_groq))
+
+    errors: list[str] = []
+    start_time = time.monotonic()
+    for index, (name, stream) in enumerate(providers):
+        parts: list[str] = []
+        first_token_latency = None
+        try:
+            async for text in stream(prompt, spec):
+                if first_token_latency is None:
+                    first_token_latency = time.monotonic() - start_time
+                    print(f"STREAM FIRST TOKEN: tool={tool} provider={name} TTFT={first_token_latency:.2f}s")
+                parts.append(text)
+                yield "token", {"text": text}
+        except Exception as e:
+            error_msg = f"{name} stream failed: {str(e)}"
+            print(error_msg)
+            errors.append(error_msg)
+            if index + 1 < len(providers):
+                yield "fallback", {
+                    "provider": providers[index + 1][0],
+                    "discard_partial": bool(parts),
+                }
+            continue
+
+        result = "".join(parts)
+        if cache_key and result and name == PRIMARY_PROVIDER:
+            await ai_cache.set(cache_key, tool, result, ttl=spec.cache_ttl)
+        yield "done", {"provider": name, "first_token_latency": round(first_token_latency or 0.0, 3)}
+        return
+
+    raise HTTPException(
+        status_code=500,
+        detail=f"All AI providers failed. Diagnostics: {'; '.join(errors)}",
+    )
+
+
+def sse_event(event: str, payload: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def sse_from_ai_stream(prompt: str, tool: str | None = None):
+    """Render stream_ai_response as Server-Sent Events."""
+    try:
+        async for event, payload in stream_ai_response(prompt, tool=tool):
+            yield sse_event(event, payload)
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail})
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+# --- Long Document Summarization ---
+# Inputs longer than one pass are split on paragraph/sentence boundaries,
+# summarized chunk by chunk in parallel, then merged hierarchically, so the
+# whole document is covered and latency grows with depth rather than length.
+SUMMARY_SINGLE_PASS_CHARS = int(os.getenv("SUMMARY_SINGLE_PASS_CHARS", "24000"))
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "12000"))
+SUMMARY_CHUNK_OVERLAP = int(os.getenv("SUMMARY_CHUNK_OVERLAP", "400"))
+SUMMARY_MAX_PARALLEL = int(os.getenv("SUMMARY_MAX_PARALLEL", "8"))
+SUMMARY_REDUCE_FANIN = max(int(os.getenv("SUMMARY_REDUCE_FANIN", "6")), 2)  # Below 2 the reduce never converges
+SUMMARY_MAX_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", "64"))  # Caps the provider calls one input can fan out to
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?。])\s+")
+
+
+def split_units(text: str, max_chars: int) -> list[str]:
+    """Break text into paragraphs, sentences, or hard slices no longer than max_chars."""
+    units: list[str] = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            units.append(paragraph)
+            continue
+        for sentence in SENTENCE_BREAK.split(paragraph):
+            while len(sentence) > max_chars:
+                units.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                units.append(sentence)
+    return units
+
+
+def chunk_text(text: str, max_chars: int, overlap: int) -> list[str]:
+    """Pack boundary-aligned units into chunks, repeating up to `overlap` chars."""
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for unit in split_units(text, max_chars):
+        if current and size + len(unit) + 1 > max_chars:
+            chunks.append(" ".join(current))
+            carried: list[str] = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + len(previous) > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current, size = carried, carried_size
+        current.append(unit)
+        size += len(unit) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+async def gather_or_cancel(coros: list[Awaitable[Any]]) -> list[Any]:
+    """gather() that cancels the siblings as soon as one call fails."""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def summarize_long_text(text: str, final_template: str, tool: str) -> str:
+    """Summarize text of any length with `final_template` shaping the answer.
+
+    `final_template` is the tool's usual prompt with a `{content}` slot. Short
+    inputs go straight through it; long ones are map-reduced first and the
+    merged notes are fed to it instead. Inputs needing more than
+    SUMMARY_MAX_CHUNKS chunks are rejected with a 413.
+    """
+    if len(text) <= SUMMARY_SINGLE_PASS_CHARS:
+        return await generate_ai_response(final_template.format(content=text), tool=tool, content=text)
+
+    slots = asyncio.Semaphore(SUMMARY_MAX_PARALLEL)
+
+    async def ask(prompt: str, stage: str, content: str) -> str:
+        async with slots:
+            return await generate_ai_response(prompt, tool=f"{tool}:{stage}", content=content)
+
+    timings: dict[str, float] = {}
+    stage_start = time.monotonic()
+    chunks = chunk_text(text, SUMMARY_CHUNK_CHARS, SUMMARY_CHUNK_OVERLAP)
+    timings["split"] = time.monotonic() - stage_start
+    if len(chunks) > SUMMARY_MAX_CHUNKS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Input is too long to summarize ({len(chunks)} chunks, limit {SUMMARY_MAX_CHUNKS}).",
+        )
+
+    stage_start = time.monotonic()
+    notes = await gather_or_cancel([
+        ask(
+            f"You are reading part {i + 1} of {len(chunks)} of a longer document. "
+            f"Extract its key points, facts, names and figures as concise bullet notes:\n\n{chunk}",
+            "map",
+            chunk,
+        )
+        for i, chunk in enumerate(chunks)
+    ])
+    timings["map"] = time.monotonic() - stage_start
+
+    stage_start = time.monotonic()
+    levels = 0
+    while len(notes) > SUMMARY_REDUCE_FANIN:
+        groups = [notes[i:i + SUMMARY_REDUCE_FANIN] for i in range(0, len(notes), SUMMARY_REDUCE_FANIN)]
+        notes = await gather_or_cancel([
+            ask(
+                "Merge these consecutive sets of notes from one document into a single set of "
+                "concise bullet notes, keeping every distinct key point in order:\n\n"
+                + "\n\n---\n\n".join(group),
+                "reduce",
+                "\n\n".join(group),
+            )
+            for group in groups
+        ])
+        levels += 1
+    timings["reduce"] = time.monotonic() - stage_start
+
+    stage_start = time.monotonic()
+    merged = "\n\n".join(notes)
+    result = await generate_ai_response(final_template.format(content=merged), tool=tool, content=text)
+    timings["final"] = time.monotonic() - stage_start
+
+    print(
+        f"MAP-REDUCE: tool={tool} chars={len(text)} chunks={len(chunks)} levels={levels} "
+        + " ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+    )
+    return result
+
+
+def build_tool_prompt(tool: str, req: AIRequest) -> str:
+    return TOOL_REGISTRY[tool].render(req)
+
+
+def is_text_tool(tool: str) -> bool:
+    spec = TOOL_REGISTRY.get(tool)
+    return spec is not None and spec.template is not None
+
+
+@app.post("/api/tools/{tool}")
+async def run_tool(tool: str, req: AIRequest, stream: bool = False):
+    """Generic dispatcher for every registered text tool.
+
+    With `?stream=1` the answer is pushed token by token as Server-Sent Events.
+    """
+    if not is_text_tool(tool):
+        raise HTTPException(status_code=404, detail=f"Unknown tool: {tool}")
+    prompt = build_tool_prompt(tool, req)
+    if stream:
+        return StreamingResponse(
+            sse_from_ai_stream(prompt, tool=tool),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+    result = await generate_ai_response(prompt, tool=tool, content=req.content)
+    return {"result": result}
+
+
+@app.post("/api/stream/{tool}")
+async def stream_tool(tool: str, req: AIRequest):
+    """Stream any text tool's answer token by token as Server-Sent Events."""
+    return await run_tool(tool, req, stream=True)
+
+
+def register_tool_alias(spec: ToolSpec):
+    """Keep the historical POST /api/<route> path working for a registry tool."""
+
+    async def tool_alias(req: AIRequest, stream: bool = False):
+        return await run_tool(spec.name, req, stream=stream)
+
+    app.add_api_route(
+        f"/api/{spec.route}",
+        tool_alias,
+        methods=["POST"],
+        name=spec.name.replace("-", "_"),
+    )
+
+
+for _spec in TOOL_REGISTRY.values():
+    if _spec.template is not None and _spec.route:
+        register_tool_alias(_spec)
+
+
+class BatchItem(BaseModel):
+    tool: str
+    content: str
+    context: str = ""
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    stream: bool = False
+
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", "16"))
+
+
+async def run_batch_item(index: int, item: BatchItem, slots: asyncio.Semaphore):
+    """Run one batch job, turning failures into a per-item error entry."""
+    entry: dict[str, Any] = {"index": index, "tool": item.tool}
+    if not is_text_tool(item.tool):
+        entry.update(error=f"Unknown tool: {item.tool}", status_code=404)
+        return entry
+    try:
+        async with slots:
+            prompt = build_tool_prompt(item.tool, AIRequest(content=item.content, context=item.context))
+            entry["result"] = await generate_ai_response(prompt, tool=item.tool, content=item.content)
+    except HTTPException as e:
+        entry.update(error=e.detail, status_code=e.status_code)
+    except Exception as e:
+        entry.update(error=str(e), status_code=500)
+    return entry
+
+
+@app.post("/api/batch")
+async def run_batch(req: BatchRequest, request: Request):
+    """Run many text tool jobs in one request.
+
+    The API key is validated and charged once for the whole batch, one
+    credit per item naming a known tool; unknown tools come back as free
+    404 entries. Results come back in input order, or as SSE `item` events
+    in completion order when `stream` is set.
+    """
+    if not req.items:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one item.")
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} items.")
+
+    api_key = request.headers.get("X-API-KEY")
+    billable = sum(1 for item in req.items if is_text_tool(item.tool))
+    if api_key and billable:
+        status = await validate_api_key(api_key, credits=float(billable), endpoint="batch")
+        if status == "insufficient_balance":
+            raise HTTPException(status_code=402, detail="Insufficient credits for this batch.")
+        if not status:
+            raise HTTPException(status_code=401, detail="Invalid or inactive API key.")
+
+    slots = asyncio.Semaphore(BATCH_MAX_PARALLEL)
+    tasks = [asyncio.create_task(run_batch_item(i, item, slots)) for i, item in enumerate(req.items)]
+
+    if not req.stream:
+        return {"results": await asyncio.gather(*tasks)}
+
+    async def events():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield sse_event("item", await next_done)
+            yield sse_event("done", {"count": len(tasks)})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# --- YouTube Transcripts ---
+# Transcripts are cached by canonical video id, so every URL form of a video
+# (watch, youtu.be, shorts, embed, live, mobile) shares one entry. On a miss
+# the Apify actor is started asynchronously and polled with server-side waits;
+# concurrent requests for the same video share the run, and the dataset is
+# streamed only until a full transcript item turns up.
+YOUTUBE_ACTOR = "streamers/youtube-scraper"
+YOUTUBE_TRANSCRIPT_DB = os.getenv("YOUTUBE_TRANSCRIPT_DB", os.path.join(DATA_DIR, "youtube.sqlite3"))
+YOUTUBE_TRANSCRIPT_TTL = int(os.getenv("YOUTUBE_TRANSCRIPT_TTL", str(7 * 86400)))
+YOUTUBE_RUN_TIMEOUT = float(os.getenv("YOUTUBE_RUN_TIMEOUT", "300"))
+YOUTUBE_POLL_WAIT = int(os.getenv("YOUTUBE_POLL_WAIT", "30"))
+YOUTUBE_TERMINAL_STATUSES = {"SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"}
+YOUTUBE_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+
+
+def youtube_video_id(url: str) -> str | None:
+    url = url.strip()
+    if YOUTUBE_ID.match(url):
+        return url
+    parts = urllib.parse.urlsplit(url if "://" in url else f"https://{url}")
+    host = (parts.hostname or "").lower().removeprefix("www.")
+    segments = [segment for segment in parts.path.split("/") if segment]
+    candidate = None
+    if host == "youtu.be" and segments:
+        candidate = segments[0]
+    elif host in YOUTUBE_HOSTS:
+        query = urllib.parse.parse_qs(parts.query)
+        if query.get("v"):
+            candidate = query["v"][0]
+        elif len(segments) >= 2 and segments[0] in ("shorts", "embed", "live", "v", "e"):
+            candidate = segments[1]
+    return candidate if candidate and YOUTUBE_ID.match(candidate) else None
+
+
+class TranscriptCache:
+    """Video transcripts in SQLite with a TTL."""
+
+    def __init__(self, path: str, ttl: int):
+        self.path = path
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "actor_runs": 0, "early_stops": 0}
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts (video_key TEXT PRIMARY KEY, transcript TEXT, expires_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _get(self, video_key: str) -> str | None:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT transcript FROM transcripts WHERE video_key = ? AND expires_at > ?", (video_key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, video_key: str, transcript: str):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO transcripts (video_key, transcript, expires_at) VALUES (?, ?, ?)",
+                (video_key, transcript, time.time() + self.ttl),
+            )
+            db.execute("DELETE FROM transcripts WHERE expires_at < ?", (time.time(),))
+            db.commit()
+
+    async def get(self, video_key: str) -> str | None:
+        try:
+            transcript = await asyncio.to_thread(self._get, video_key)
+        except Exception as e:
+            print(f"Transcript cache read error: {e}")
+            transcript = None
+        self.stats["hits" if transcript is not None else "misses"] += 1
+        return transcript
+
+    async def set(self, video_key: str, transcript: str):
+        try:
+            await asyncio.to_thread(self._set, video_key, transcript)
+        except Exception as e:
+            print(f"Transcript cache write error: {e}")
+
+    def snapshot(self) -> dict[str, Any]:
+        return dict(self.stats)
+
+
+transcript_cache = TranscriptCache(YOUTUBE_TRANSCRIPT_DB, YOUTUBE_TRANSCRIPT_TTL)
+
+
+async def run_youtube_actor(url: str) -> str:
+    # Call Apify Actor
+    # Using streamers/youtube-scraper which is highly reliable
+    run_input = {
+        "downloadSubtitles": True,
+        "saveSubsToItems": True,
+        "startUrls": [{"url": url}],
+        "maxResults": 1,
+    }
+
+    # Start the run, then wait on it server-side in short slices
+    run = await apify_client.actor(YOUTUBE_ACTOR).start(run_input=run_input)
+    transcript_cache.stats["actor_runs"] += 1
+    deadline = time.monotonic() + YOUTUBE_RUN_TIMEOUT
+    while run and run.get("status") not in YOUTUBE_TERMINAL_STATUSES:
+        if time.monotonic() >= deadline:
+            await apify_client.run(run["id"]).abort()
+            raise Exception(f"Apify actor run exceeded {YOUTUBE_RUN_TIMEOUT:.0f}s.")
+        run = await apify_client.run(run["id"]).wait_for_finish(wait_secs=YOUTUBE_POLL_WAIT)
+    if not run or run.get("status") != "SUCCEEDED":
+        raise Exception(f"Apify actor run failed: {run.get('status') if run else 'no data'}.")
+
+    transcript_parts: list[str] = []
+    # Stream results from the dataset, stopping at the first full transcript
+    async for item in apify_client.dataset(run["defaultDatasetId"]).iterate_items():
+        if "transcript" in item:
+            transcript_parts.append(str(item.get("transcript", "")))
+            transcript_cache.stats["early_stops"] += 1
+            break
+        elif "text" in item and item["text"]:
+            transcript_parts.append(str(item.get("text", "")) + " ")
+
+    return "".join(transcript_parts)
+
+
+async def fetch_youtube_transcript(url: str) -> str:
+    video_id = youtube_video_id(url)
+    video_key = video_id or canonical_url(url)
+    if not cache_bypass.get():
+        cached = await transcript_cache.get(video_key)
+        if cached is not None:
+            return cached
+
+    async def compute() -> str:
+        # Always hand the actor the canonical watch URL for a known video
+        target = f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+        transcript = await run_youtube_actor(target)
+        if transcript:
+            await transcript_cache.set(video_key, transcript)
+        return transcript
+
+    return await scrape_flights.do(flight_key("youtube", video_key), compute)
+
+
+@app.post("/api/youtube-summarizer")
+async def summarize_youtube(req: AIRequest):
+    try:
+        return {"result": await summarize_youtube_url(req.content.strip())}
+    except HTTPException as e:
+        if e.status_code == 500:
+            raise
+        raise HTTPException(status_code=500, detail=f"Apify Error: {e.detail}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Apify Error: {str(e)}")
+
+
+async def summarize_youtube_url(url: str) -> str:
+    if not apify_client:
+        raise HTTPException(
+            status_code=500,
+            detail="APIFY_API_TOKEN not found. Please add it to your .env file to enable YouTube summaries.",
+        )
+
+    transcript_text = await fetch_youtube_transcript(url)
+
+    if not transcript_text:
+        raise HTTPException(
+            status_code=400,
+            detail="Could not retrieve transcript. Ensure the video has captions available.",
+        )
+
+    prompt_template = (
+        "Please provide a comprehensive summary with key takeaways of this YouTube video based on its transcript. "
+        "Here is the transcript:\n\n{content}"
+    )
+    return await summarize_long_text(transcript_text, prompt_template, "youtube-summarizer")
+
+
+# --- Image Store ---
+# Generated images are stored once under their SHA-256 digest and indexed by
+# the normalized user prompt (plus the enhanced prompt that produced them).
+# Clients get a short-lived signed URL; the bytes behind it never change, so
+# browsers and CDNs can cache them indefinitely.
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(DATA_DIR, "images"))
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+IMAGE_URL_TTL = int(os.getenv("IMAGE_URL_TTL", "3600"))
+IMAGE_EXTENSIONS = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+
+def image_extension(content: bytes) -> str:
+    if content.startswith(b"\x89PNG"):
+        return "png"
+    if content.startswith(b"RIFF"):
+        return "webp"
+    if content.startswith(b"GIF"):
+        return "gif"
+    return "jpg"
+
+
+def load_image_url_secret() -> bytes:
+    """Signing key for image URLs, shared by all workers on the host."""
+    secret = os.getenv("IMAGE_URL_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    path = os.path.join(DATA_DIR, "image_url_secret")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    try:
+        with open(path, "xb") as f:
+            f.write(os.urandom(32).hex().encode("ascii"))
+    except FileExistsError:
+        pass
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+
+class ImageStore:
+    """Content-addressed image files with a prompt index and size-bounded LRU."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"), timeout=10, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "digest TEXT PRIMARY KEY, ext TEXT, size INTEGER, accessed_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompts ("
+                "prompt_key TEXT PRIMARY KEY, digest TEXT, enhanced_prompt TEXT, created_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.{ext}")
+
+    def _lookup(self, prompt_key: str) -> dict[str, Any] | None:
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT p.digest, p.enhanced_prompt, b.ext FROM prompts p "
+                "LEFT JOIN blobs b ON b.digest = p.digest WHERE p.prompt_key = ?",
+                (prompt_key,),
+            ).fetchone()
+            if not row:
+                return None
+            digest, enhanced_prompt, ext = row
+            if ext and os.path.exists(self.path(digest, ext)):
+                db.execute("UPDATE blobs SET accessed_at = ? WHERE digest = ?", (time.time(), digest))
+                db.commit()
+                return {"digest": digest, "ext": ext, "enhanced_prompt": enhanced_prompt}
+            return {"digest": None, "ext": None, "enhanced_prompt": enhanced_prompt}
+
+    def _put(self, prompt_key: str, content: bytes, enhanced_prompt: str) -> tuple[str, str]:
+        digest = hashlib.sha256(content).hexdigest()
+        ext = image_extension(content)
+        target = self.path(digest, ext)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f"{target}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, target)
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO blobs (digest, ext, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (digest, ext, len(content), now),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO prompts (prompt_key, digest, enhanced_prompt, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (prompt_key, digest, enhanced_prompt, now),
+            )
+            self._evict(db)
+            db.commit()
+        return digest, ext
+
+    def _evict(self, db: sqlite3.Connection):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for digest, ext, size in db.execute(
+            "SELECT digest, ext, size FROM blobs ORDER BY accessed_at"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(digest, ext))
+            except FileNotFoundError:
+                pass
+            # Prompt rows stay so a regenerate can skip the enhancer call
+            db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            total -= size
+            self.stats["evicted"] += 1
+
+    async def lookup(self, prompt_key: str) -> dict[str, Any] | None:
+        entry = await asyncio.to_thread(self._lookup, prompt_key)
+        self.stats["hits" if entry and entry["digest"] else "misses"] += 1
+        return entry
+
+    async def put(self, prompt_key: str, content: bytes, enhanced_prompt: str) -> tuple[str, str]:
+        self.stats["stored"] += 1
+        return await asyncio.to_thread(self._put, prompt_key, content, enhanced_prompt)
+
+    def snapshot(self) -> dict[str, Any]:
+        return dict(self.stats)
+
+
+image_store = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES)
+image_url_secret = load_image_url_secret()
+
+
+def image_prompt_key(user_prompt: str) -> str:
+    return hashlib.sha256(normalize_prompt(user_prompt).lower().encode("utf-8")).hexdigest()
+
+
+def sign_image_name(name: str, expires: int) -> str:
+    return hmac.new(image_url_secret, f"{name}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def public_base_url(request: Request) -> str:
+    return PUBLIC_BASE_URL or str(request.base_url).rstrip("/")
+
+
+def signed_image_url(request: Request, digest: str, ext: str) -> tuple[str, int]:
+    name = f"{digest}.{ext}"
+    expires = int(time.time()) + IMAGE_URL_TTL
+    query = urllib.parse.urlencode({"exp": expires, "sig": sign_image_name(name, expires)})
+    return f"{public_base_url(request)}/api/images/{name}?{query}", expires
+
+
+# --- Image Synthesis ---
+# Providers are raced rather than walked in order: up to IMAGE_RACE_WIDTH run
+# at once, a new one joins every IMAGE_HEDGE_DELAY seconds or as soon as one
+# fails, the first valid image wins and the rest are cancelled.
+IMAGE_RACE_WIDTH = int(os.getenv("IMAGE_RACE_WIDTH", "3"))
+IMAGE_HEDGE_DELAY = float(os.getenv("IMAGE_HEDGE_DELAY", "8"))
+IMAGE_DEADLINE = float(os.getenv("IMAGE_DEADLINE", "90"))
+HF_IMAGE_MODELS = [
+    "black-forest-labs/FLUX.1-schnell",
+    "stabilityai/sdxl-turbo",
+    "stabilityai/stable-diffusion-xl-base-1.0",
+    "runwayml/stable-diffusion-v1-5",
+]
+BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+
+# --- Hugging Face Warmth & Health ---
+# Cold HF models answer 503 while they load. A background prober keeps a
+# health table per (model, endpoint), pings the models we serve so they stay
+# loaded, and orders providers by observed success rate and latency. User
+# requests only wait out a load when no warm HF model is available.
+HF_PROBE_ENABLED = os.getenv("HF_PROBE_ENABLED", "1") != "0"
+HF_PROBE_INTERVAL = float(os.getenv("HF_PROBE_INTERVAL", "240"))
+HF_PROBE_TIMEOUT = float(os.getenv("HF_PROBE_TIMEOUT", "30"))
+HF_WARM_WINDOW = float(os.getenv("HF_WARM_WINDOW", "600"))
+HF_HEALTH_ALPHA = 0.3
+HF_ENDPOINTS = {
+    "router": "https://router.huggingface.co/hf-inference/models/{model}",
+    "legacy": "https://api-inference.huggingface.co/models/{model}",
+}
+
+
+@dataclass
+class EndpointHealth:
+    success_rate: float = 0.5
+    latency: float | None = None
+    last_ok: float = 0.0
+    last_cold: float = 0.0
+    last_status: int | None = None
+    samples: int = 0
+
+    def warm(self, now: float) -> bool:
+        return self.last_ok > self.last_cold and now - self.last_ok < HF_WARM_WINDOW
+
+    def cold(self) -> bool:
+        return self.last_cold > self.last_ok
+
+    def score(self, now: float) -> float:
+        # Warm beats unknown beats cold; within a class, reliable and fast wins.
+        warmth = 1.0 if self.warm(now) else (-1.0 if self.cold() else 0.0)
+        latency_penalty = min((self.latency or 10.0) / 60.0, 1.0)
+        return warmth * 2 + self.success_rate - latency_penalty * 0.5
+
+
+class HFHealthTable:
+    def __init__(self, models: list[str]):
+        self.models = models
+        self.table: dict[tuple[str, str], EndpointHealth] = {
+            (m, ep): EndpointHealth() for m in models for ep in HF_ENDPOINTS
+        }
+        self.probes = 0
+
+    def entry(self, model: str, endpoint: str) -> EndpointHealth:
+        return self.table.setdefault((model, endpoint), EndpointHealth())
+
+    def record(self, model: str, endpoint: str, status: int | None, latency: float | None = None) -> None:
+        entry = self.entry(model, endpoint)
+        now = time.time()
+        ok = status == 200
+        entry.samples += 1
+        entry.last_status = status
+        entry.success_rate += HF_HEALTH_ALPHA * ((1.0 if ok else 0.0) - entry.success_rate)
+        if ok:
+            entry.last_ok = now
+            if latency is not None:
+                entry.latency = latency if entry.latency is None else entry.latency + HF_HEALTH_ALPHA * (latency - entry.latency)
+        elif status == 503:
+            entry.last_cold = now
+
+    def best_endpoint_score(self, model: str, now: float) -> float:
+        return max(self.entry(model, ep).score(now) for ep in HF_ENDPOINTS)
+
+    def ranked_models(self) -> list[str]:
+        now = time.time()
+        return sorted(self.models, key=lambda m: self.best_endpoint_score(m, now), reverse=True)
+
+    def ranked_endpoints(self, model: str) -> list[tuple[str, str]]:
+        now = time.time()
+        order = sorted(HF_ENDPOINTS, key=lambda ep: self.entry(model, ep).score(now), reverse=True)
+        return [(ep, HF_ENDPOINTS[ep].format(model=model)) for ep in order]
+
+    def warm_alternative(self, model: str) -> bool:
+        now = time.time()
+        return any(
+            entry.warm(now) for (m, _), entry in self.table.items() if m != model
+        )
+
+    def snapshot(self) -> dict[str, Any]:
+        now = time.time()
+        return {
+            "probes": self.probes,
+            "ranking": self.ranked_models(),
+            "endpoints": {
+                f"{m}@{ep}": {
+                    "warm": entry.warm(now),
+                    "cold": entry.cold(),
+                    "success_rate": round(entry.success_rate, 3),
+                    "latency": round(entry.latency, 2) if entry.latency is not None else None,
+                    "last_status": entry.last_status,
+                    "samples": entry.samples,
+                }
+                for (m, ep), entry in self.table.items()
+            },
+        }
+
+
+hf_health = HFHealthTable(HF_IMAGE_MODELS)
+
+
+async def probe_hf_endpoint(client: OutboundHTTP, model: str, endpoint: str, url: str) -> None:
+    # A minimal inference both measures the endpoint and triggers a load on a
+    # cold model; wait_for_model=False keeps the probe from blocking on it.
+    payload = {
+        "inputs": "warmup",
+        "parameters": {"num_inference_steps": 1, "width": 256, "height": 256},
+        "options": {"wait_for_model": False},
+    }
+    started = time.monotonic()
+    status: int | None = None
+    try:
+        async with client.stream(
+            "POST", url, headers={"Authorization": f"Bearer {HF_TOKEN}"}, json=payload, timeout=HF_PROBE_TIMEOUT
+        ) as response:
+            status = response.status_code
+    except httpx.HTTPError as e:
+        print(f"HF probe {model}@{endpoint} failed: {str(e)[:80]}")
+    hf_health.record(model, endpoint, status, time.monotonic() - started)
+    hf_health.probes += 1
+
+
+@background_service
+async def hf_warmup_prober() -> None:
+    if not HF_TOKEN or not HF_PROBE_ENABLED:
+        return
+    while True:
+        # Only the preferred endpoint of each model is pinged; the other
+        # is learned from user traffic when the first one misbehaves.
+        await asyncio.gather(
+            *(
+                probe_hf_endpoint(outbound, model, *hf_health.ranked_endpoints(model)[0])
+                for model in hf_health.models
+            )
+        )
+        await asyncio.sleep(HF_PROBE_INTERVAL)
+
+
+def build_image_providers(prompt_encoded: str) -> list[dict[str, Any]]:
+    # Provider Hierarchy: Fast Direct APIs -> Hugging Face -> Leonardo
+    providers: list[dict[str, Any]] = [
+        {
+            "name": "Pollinations High-Stability",
+            "url": f"https://image.pollinations.ai/prompt/{prompt_encoded}?width=1024&height=1024&nologo=true&model=flux",
+            "type": "direct",
+        },
+        {
+            "name": "Airforce SDXL (Global)",
+            "url": f"https://api.airforce/v1/image-generation?model=stable-diffusion-xl&prompt={prompt_encoded}",
+            "type": "direct",
+        },
+    ]
+
+    # Add Hugging Face nodes if token is available, healthiest and warmest first
+    if HF_TOKEN:
+        for m_id in hf_health.ranked_models():
+            providers.append(
+                {
+                    "name": f"Hugging Face ({m_id.split('/')[-1]})",
+                    "model": m_id,
+                    "type": "hf",
+                    "headers": {"Authorization": f"Bearer {HF_TOKEN}"},
+                }
+            )
+
+    # Fallback nodes (Mirrors and Aggregators)
+    providers.append(
+        {
+            "name": "Leonardo.ai (Premium Cluster)",
+            "type": "leonardo",
+            "key": LEONARDO_API_KEY,
+        }
+    )
+    return providers
+
+
+def is_image_payload(content: bytes) -> bool:
+    # Check for Image Magic Bytes (Flexible)
+    signature = content[:10]
+    return (
+        signature.startswith(b"\xff\xd8")  # JPG
+        or signature.startswith(b"\x89PNG")  # PNG
+        or signature.startswith(b"RIFF")  # WebP
+        or signature.startswith(b"GIF")  # GIF
+    )
+
+
+IMAGE_MIN_BYTES = 5000
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_JSON_MAX_BYTES = 256 * 1024
+IMAGE_SNIFF_BYTES = 12
+
+
+class ImageDownloadError(Exception):
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def download_image(
+    client: OutboundHTTP, method: str, url: str, allow_json: bool = False, **kwargs: Any
+) -> bytearray:
+    """Stream an image body, bailing out as soon as it clearly is not one.
+
+    The status, Content-Type, Content-Length and the first bytes are checked
+    before the rest of the body is read. The payload goes into a single
+    buffer, preallocated when the length is known and capped at
+    IMAGE_MAX_BYTES. Content-Length counts encoded bytes, so it is only
+    trusted when the body is not content-encoded (gzip, br, ...). When `allow_json` is set, a small JSON body carrying a
+    `url` is followed, as some aggregators answer that way.
+    """
+    async with client.stream(method, url, **kwargs) as response:
+        if response.status_code != 200:
+            raise ImageDownloadError(f"HTTP {response.status_code}", response.status_code)
+
+        content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type in ("text/html", "text/plain"):
+            raise ImageDownloadError(f"Got {content_type} instead of an image (Likely Cloudflare Challenge/HTML).")
+        if content_type == "application/json":
+            if not allow_json:
+                raise ImageDownloadError("Got JSON instead of an image.")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > IMAGE_JSON_MAX_BYTES:
+                    raise ImageDownloadError("JSON payload too large.")
+            try:
+                target_url = json.loads(body)["url"]
+            except Exception:
+                raise ImageDownloadError("Not an image and no URL in JSON.")
+            return await download_image(client, "GET", target_url, timeout=30)
+
+        declared = response.headers.get("content-length")
+        encoded = response.headers.get("content-encoding", "identity").strip().lower() not in ("", "identity")
+        expected = int(declared) if declared and declared.isdigit() and not encoded else None
+        if expected is not None and expected > IMAGE_MAX_BYTES:
+            raise ImageDownloadError(f"Payload of {expected} bytes exceeds the {IMAGE_MAX_BYTES} byte cap.")
+        if expected is not None and expected < IMAGE_MIN_BYTES:
+            raise ImageDownloadError("Provider payload too small/empty.")
+
+        buffer = bytearray(expected) if expected is not None else bytearray()
+        view = memoryview(buffer) if expected is not None else None
+        received = 0
+        sniffed = False
+        try:
+            async for chunk in response.aiter_bytes():
+                end = received + len(chunk)
+                if end > (expected if expected is not None else IMAGE_MAX_BYTES):
+                    raise ImageDownloadError("Payload exceeds its declared length or the byte cap.")
+                if view is not None:
+                    view[received:end] = chunk
+                else:
+                    buffer += chunk
+                received = end
+                if not sniffed and received >= IMAGE_SNIFF_BYTES:
+                    sniffed = True
+                    if not is_image_payload(bytes(buffer[:IMAGE_SNIFF_BYTES])):
+                        raise ImageDownloadError("Binary signature mismatch (Likely Cloudflare Challenge/HTML).")
+        finally:
+            if view is not None:
+                view.release()
+
+    if expected is not None and received < expected:
+        raise ImageDownloadError(f"Truncated payload: got {received} of {expected} bytes.")
+    if received < IMAGE_MIN_BYTES:
+        raise ImageDownloadError("Provider payload too small/empty.")
+    if not sniffed and not is_image_payload(bytes(buffer[:IMAGE_SNIFF_BYTES])):
+        raise ImageDownloadError("Binary signature mismatch (Likely Cloudflare Challenge/HTML).")
+    return buffer
+
+
+async def fetch_direct_image(client: OutboundHTTP, provider: dict[str, Any], prompt: str) -> bytearray:
+    headers = {
+        "User-Agent": BROWSER_USER_AGENT,
+        "Accept": "image/*",
+        "Referer": "https://www.bing.com/",
+    }
+    return await download_image(client, "GET", str(provider["url"]), allow_json=True, headers=headers, timeout=40)
+
+
+async def fetch_hf_image(client: OutboundHTTP, provider: dict[str, Any], prompt: str) -> bytearray:
+    # Hugging Face Inference Call - router and legacy endpoints, healthiest first
+    model = provider["model"]
+    payload = {"inputs": prompt}
+    for endpoint, ep_url in hf_health.ranked_endpoints(model):
+        for attempt in range(2):
+            started = time.monotonic()
+            try:
+                content = await download_image(
+                    client, "POST", ep_url, headers=provider.get("headers", {}), json=payload, timeout=60
+                )
+            except ImageDownloadError as e:
+                hf_health.record(model, endpoint, e.status_code)
+                if e.status_code == 503:
+                    # Never sit out a model load while another HF model is warm;
+                    # the race moves on to the next provider instead.
+                    if hf_health.warm_alternative(model):
+                        raise Exception(f"{model} is loading; a warm model is available.")
+                    if attempt == 0:
+                        print(f"Model Loading on {ep_url}. Waiting 8s...")
+                        await asyncio.sleep(8)
+                        continue
+                break
+            except httpx.HTTPError:
+                hf_health.record(model, endpoint, None)
+                break
+            hf_health.record(model, endpoint, 200, time.monotonic() - started)
+            return content
+    raise Exception("Hugging Face failed all endpoint attempts.")
+
+
+async def fetch_leonardo_image(client: OutboundHTTP, provider: dict[str, Any], prompt: str) -> bytearray:
+    provider_key = provider.get("key")
+    if not provider_key:
+        raise Exception("Leonardo API Key missing.")
+
+    leo_headers = {
+        "accept": "application/json",
+        "content-type": "application/json",
+        "authorization": f"Bearer {provider_key}",
+    }
+
+    # Start Generation
+    start_url = "https://cloud.leonardo.ai/api/rest/v1/generations"
+    payload = {
+        "height": 512,
+        "width": 512,
+        "prompt": prompt,
+        "num_images": 1,
+    }
+    response = await client.post(start_url, json=payload, headers=leo_headers, timeout=30)
+    gen_id = response.json().get("sdGenerationJob", {}).get("generationId")
+
+    if not gen_id:
+        raise Exception("Leonardo failed to initiate job.")
+
+    # Poll for Result
+    poll_url = f"https://cloud.leonardo.ai/api/rest/v1/generations/{gen_id}"
+    for _ in range(10):  # Max 30 seconds
+        await asyncio.sleep(3)
+        resp = await client.get(poll_url, headers=leo_headers, timeout=30)
+        images = resp.json().get("generations_by_pk", {}).get("generated_images", [])
+        if images:
+            return await download_image(client, "GET", images[0].get("url"), timeout=30)
+
+    raise Exception("Leonardo job timed out.")
+
+
+IMAGE_FETCHERS = {
+    "direct": fetch_direct_image,
+    "hf": fetch_hf_image,
+    "leonardo": fetch_leonardo_image,
+}
+
+
+async def fetch_provider_image(client: OutboundHTTP, provider: dict[str, Any], prompt: str) -> bytearray:
+    """Fetch one provider's image; downloads reject non-images as they stream."""
+    print(f"Protocol [{provider['name']}] Synchronization...")
+    return await IMAGE_FETCHERS[provider["type"]](client, provider, prompt)
+
+
+async def race_image_providers(
+    client: OutboundHTTP, providers: list[dict[str, Any]], prompt: str, errors: list[str]
+) -> tuple[bytearray, str] | None:
+    """Return the first valid image from staggered, concurrent provider attempts."""
+    queue = list(providers)
+    pending: dict[asyncio.Task, str] = {}
+    deadline = time.monotonic() + IMAGE_DEADLINE
+    next_launch = time.monotonic()
+
+    try:
+        while queue or pending:
+            now = time.monotonic()
+            if now >= deadline:
+                errors.append(f"Global deadline of {IMAGE_DEADLINE:.0f}s reached")
+                return None
+            if queue and len(pending) < IMAGE_RACE_WIDTH and (now >= next_launch or not pending):
+                provider = queue.pop(0)
+                task = asyncio.create_task(fetch_provider_image(client, provider, prompt))
+                pending[task] = provider["name"]
+                next_launch = now + IMAGE_HEDGE_DELAY
+                continue
+
+            wake_at = deadline
+            if queue and len(pending) < IMAGE_RACE_WIDTH:
+                wake_at = min(wake_at, next_launch)
+            done, _ = await asyncio.wait(
+                pending, timeout=max(wake_at - now, 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    content = task.result()
+                except Exception as e:
+                    print(f"Failover Protocol: {name} - {str(e)[:150]}")
+                    errors.append(f"{name} ({str(e)[:40]})")
+                    next_launch = time.monotonic()  # Replace the failed node right away
+                    continue
+                print(f"Synthesis [{name}] SUCCESSFUL.")
+                return content, name
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def synthesize_image(user_prompt: str) -> tuple[str, str]:
+    """Digest and extension of the stored image for `user_prompt`, generating it if needed."""
+    prompt_key = image_prompt_key(user_prompt)
+    stored = await image_store.lookup(prompt_key)
+    if stored and stored["digest"] and not cache_bypass.get():
+        print("Synthesis [Image Store] HIT.")
+        return stored["digest"], stored["ext"]
+
+    # Phase 1: Prompt Optimization (reused when the image itself was evicted)
+    if stored and stored["enhanced_prompt"]:
+        prompt = stored["enhanced_prompt"]
+    else:
+        try:
+            enhancer_prompt = f"Act as a professional image prompt engineer. Translate if needed and expand this to a detailed 1024x1024 safe stable diffusion prompt: {user_prompt}. Respond ONLY with the prompt itself, without any conversational filler or preambles."
+            raw_prompt = await generate_ai_response(enhancer_prompt, tool="image-prompt")
+            prompt = raw_prompt.strip()
+        except Exception:
+            prompt = user_prompt.strip()
+
+    prompt_clean = re.sub(r"[^\x00-\x7f]", r"", prompt)
+    prompt_encoded = urllib.parse.quote(prompt_clean[:500])
+    errors: list[str] = []
+
+    winner = await race_image_providers(outbound, build_image_providers(prompt_encoded), prompt, errors)
+
+    if winner is None:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Global synthesis failure. Cluster exhausted. Logs: {'; '.join(errors)}",
+        )
+
+    return await image_store.put(prompt_key, winner[0], prompt)
+
+
+@app.post("/api/generate-image")
+async def generate_image_api(req: AIRequest, request: Request):
+    digest, ext = await image_flights.do(
+        flight_key("generate-image", req.content), lambda: synthesize_image(req.content)
+    )
+    url, expires = signed_image_url(request, digest, ext)
+    if accepts_media(request, "image"):
+        # Sent straight from disk; the payload is never held in Python memory
+        return FileResponse(
+            image_store.path(digest, ext),
+            media_type=IMAGE_EXTENSIONS[ext],
+            headers={"ETag": f'"{digest}"', **metadata_headers({"image_url": url})},
+        )
+    return {"result": url, "is_url": True, "expires_at": expires}
+
+
+@app.get("/api/images/{name}")
+async def serve_image(name: str, exp: int, sig: str, request: Request):
+    """Serve a stored image through a signed, expiring URL."""
+    digest, _, ext = name.partition(".")
+    if (
+        ext not in IMAGE_EXTENSIONS
+        or not re.fullmatch(r"[0-9a-f]{64}", digest)
+        or exp < time.time()
+        or not hmac.compare_digest(sig, sign_image_name(name, exp))
+    ):
+        raise HTTPException(status_code=403, detail="Image link is invalid or has expired.")
+
+    etag = f'"{digest}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    path = image_store.path(digest, ext)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image no longer available.")
+    return FileResponse(path, media_type=IMAGE_EXTENSIONS[ext], headers=cache_headers)
+
+
+# --- Job Queue ---
+# Long-running tools (YouTube transcripts, image synthesis) can run as jobs:
+# submission returns an id at once, a bounded worker pool does the work, and
+# clients poll GET /api/jobs/{id} or follow its SSE stream. Jobs live in
+# SQLite so queued and interrupted work is picked up again after a restart.
+# A running job is leased to the process that claimed it and the lease is
+# renewed while it runs; only jobs whose lease has lapsed are requeued, so
+# several workers (or an old and a new one mid-deploy) can share the file.
+JOB_DB = os.getenv("JOB_DB", os.path.join(DATA_DIR, "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_CLEANUP_INTERVAL = float(os.getenv("JOB_CLEANUP_INTERVAL", "300"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_TERMINAL_STATES = ("done", "error")
+
+
+@dataclass(frozen=True)
+class JobKind:
+    """A tool that can run as a job.
+
+    `run(content, progress)` returns a JSON-serialisable result; `present`
+    turns a stored result into the response body, e.g. to sign a fresh URL.
+    """
+
+    name: str
+    run: Callable[[str, Callable[[str], None]], Awaitable[Any]]
+    present: Callable[[Any, Request], Any] | None = None
+
+
+class JobQueue:
+    def __init__(self, path: str, workers: int, max_queued: int, result_ttl: int):
+        self.path = path
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.kinds: dict[str, JobKind] = {}
+        self.queue: asyncio.Queue[str] | None = None
+        self.watchers: dict[str, set[asyncio.Queue]] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "recovered": 0, "expired": 0}
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._progress_writes: set[asyncio.Task] = set()
+
+    def register(self, kind: JobKind):
+        self.kinds[kind.name] = kind
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, content TEXT, plan TEXT, status TEXT, "
+                "progress TEXT, result TEXT, error TEXT, "
+                "created_at REAL, updated_at REAL, expires_at REAL, owner TEXT, lease_expires_at REAL)"
+            )
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, expires_at)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            db = self._db()
+            rowcount = db.execute(sql, params).rowcount
+            db.commit()
+            return rowcount
+
+    def _fetch(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _requeue_expired(self, include_queued: bool) -> list[str]:
+        # Running jobs whose owner stopped renewing the lease; rows without a
+        # lease predate leasing and are treated as expired
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+                (time.time(),),
+            ).fetchall()
+            for row in rows:
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', progress = 'requeued after lease expiry', "
+                    "owner = NULL, lease_expires_at = NULL "
+                    "WHERE id = ? AND status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+                    (row["id"], time.time()),
+                )
+            db.commit()
+            if include_queued:
+                rows = db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [row["id"] for row in rows]
+
+    async def submit(self, kind: str, content: str, plan: str) -> dict[str, Any]:
+        if kind not in self.kinds:
+            raise HTTPException(status_code=404, detail=f"Unknown job kind: {kind}")
+        if self.queue is None:
+            raise HTTPException(status_code=503, detail="Job workers are not running.")
+        if self.queue.qsize() >= self.max_queued:
+            raise HTTPException(status_code=503, detail="Job queue is full. Try again shortly.")
+        job_id = secrets.token_hex(16)
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO jobs (id, kind, content, plan, status, progress, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', 'queued', ?, ?)",
+            (job_id, kind, content, plan, now, now),
+        )
+        self.queue.put_nowait(job_id)
+        self.stats["submitted"] += 1
+        return {"job_id": job_id, "status": "queued"}
+
+    async def get(self, job_id: str, request: Request) -> dict[str, Any] | None:
+        job = await asyncio.to_thread(self._fetch, job_id)
+        if job is None or (job["expires_at"] and job["expires_at"] < time.time()):
+            return None
+        body = {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "progress": job["progress"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+        if job["status"] == "done":
+            result = json.loads(job["result"])
+            kind = self.kinds.get(job["kind"])
+            body["result"] = kind.present(result, request) if kind and kind.present else result
+        elif job["status"] == "error":
+            body["error"] = job["error"]
+        return body
+
+    def _notify(self, job_id: str):
+        for watcher in self.watchers.get(job_id, ()):
+            watcher.put_nowait(None)
+
+    async def _update(self, job_id: str, sql: str, params: tuple) -> int:
+        changed = await asyncio.to_thread(self._execute, sql, params)
+        self._notify(job_id)
+        return changed
+
+    async def events(self, job_id: str, request: Request):
+        """SSE stream of a job's state: `progress` events, then `done` or `error`."""
+        wakeups: asyncio.Queue = asyncio.Queue()
+        self.watchers.setdefault(job_id, set()).add(wakeups)
+        try:
+            last_progress = None
+            while True:
+                job = await self.get(job_id, request)
+                if job is None:
+                    yield sse_event("error", {"job_id": job_id, "message": "Job not found."})
+                    return
+                if job["status"] in JOB_TERMINAL_STATES:
+                    yield sse_event(job["status"], job)
+                    return
+                if job["progress"] != last_progress:
+                    last_progress = job["progress"]
+                    yield sse_event("progress", {"job_id": job_id, "status": job["status"], "progress": last_progress})
+                try:
+                    # Updates wake us early; the timeout doubles as a keepalive poll
+                    await asyncio.wait_for(wakeups.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            watchers = self.watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(wakeups)
+                if not watchers:
+                    self.watchers.pop(job_id, None)
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(
+                    self._execute,
+                    "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                    (time.time() + JOB_LEASE_SECONDS, job_id, self.owner),
+                )
+            except Exception as e:
+                print(f"Job lease renewal error on {job_id}: {e}")
+
+    async def _run(self, job_id: str):
+        # The conditional update claims the job, so a requeued id runs once
+        now = time.time()
+        claimed = await self._update(
+            job_id,
+            "UPDATE jobs SET status = 'running', progress = 'running', updated_at = ?, owner = ?, lease_expires_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (now, self.owner, now + JOB_LEASE_SECONDS, job_id),
+        )
+        if not claimed:
+            return
+        job = await asyncio.to_thread(self._fetch, job_id)
+        kind = self.kinds.get(job["kind"])
+
+        def progress(message: str):
+            now = time.time()
+            task = asyncio.create_task(
+                self._update(
+                    job_id,
+                    "UPDATE jobs SET progress = ?, updated_at = ?, lease_expires_at = ? "
+                    "WHERE id = ? AND owner = ? AND status = 'running'",
+                    (message, now, now + JOB_LEASE_SECONDS, job_id, self.owner),
+                )
+            )
+            self._progress_writes.add(task)
+            task.add_done_callback(self._progress_writes.discard)
+
+        token = request_plan.set(job["plan"] or "free")
+        renewal = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            if kind is None:
+                raise Exception(f"Unknown job kind: {job['kind']}")
+            result = await kind.run(job["content"], progress)
+        except asyncio.CancelledError:
+            raise  # Left as 'running'; requeued once the lease lapses
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            now = time.time()
+            await self._update(
+                job_id,
+                "UPDATE jobs SET status = 'error', progress = 'failed', error = ?, updated_at = ?, expires_at = ?, "
+                "lease_expires_at = NULL WHERE id = ? AND owner = ?",
+                (str(detail), now, now + self.result_ttl, job_id, self.owner),
+            )
+            self.stats["failed"] += 1
+            return
+        finally:
+            renewal.cancel()
+            request_plan.reset(token)
+
+        now = time.time()
+        await self._update(
+            job_id,
+            "UPDATE jobs SET status = 'done', progress = 'complete', result = ?, updated_at = ?, expires_at = ?, "
+            "lease_expires_at = NULL WHERE id = ? AND owner = ?",
+            (json.dumps(result), now, now + self.result_ttl, job_id, self.owner),
+        )
+        self.stats["completed"] += 1
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job worker error on {job_id}: {e}")
+
+    async def _cleanup(self):
+        while True:
+            await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+            try:
+                self.stats["expired"] += await asyncio.to_thread(
+                    self._execute,
+                    "DELETE FROM jobs WHERE status IN ('done', 'error') AND expires_at < ?",
+                    (time.time(),),
+                )
+            except Exception as e:
+                print(f"Job cleanup error: {e}")
 
-@app.post("/api/track-visit")
-async def track_visit(track: VisitorTrack):
-    global_stats["visitors"].append({
-        "ip": track.ip,
-        "country": track.country,
-        "city": track.city,
-        "path": track.path,
-        "timestamp": datetime.now().isoformat()
-    })
-    # Keep last 1000 visitors to avoid memory bloat
-    if len(global_stats["visitors"]) > 1000:
-        global_stats["visitors"].pop(0)
-    return {"status": "tracked"}
+    async def _recover(self):
+        # Pick up jobs abandoned by workers that died, here or in another process
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS)
+            try:
+                for job_id in await asyncio.to_thread(self._requeue_expired, False):
+                    self.queue.put_nowait(job_id)
+                    self.stats["recovered"] += 1
+            except Exception as e:
+                print(f"Job recovery error: {e}")
+
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        for job_id in await asyncio.to_thread(self._requeue_expired, True):
+            self.queue.put_nowait(job_id)
+            self.stats["recovered"] += 1
+        tasks = [asyncio.create_task(self._cleanup()), asyncio.create_task(self._recover())]
+        tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Nothing may outlive a crashed serve(); the service runner starts a fresh one
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.queue = None
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "watchers": sum(len(w) for w in self.watchers.values()),
+        }
 
-@app.get("/api/admin/stats")
-async def get_admin_stats():
-    # Aggregate data from in-memory global_stats
-    visitors = global_stats["visitors"]
-    total_visitors = len(visitors)
-    
-    countries = {}
-    for v in visitors:
-        c = v.get("country", "Unknown")
-        countries[c] = countries.get(c, 0) + 1
-        
-    return {
-        "total_visitors": total_visitors,
-        "total_requests": 42, # Mocked or fetch from DB if available
-        "total_workflows": global_stats["workflows_count"] or 15,
-        "total_contacts": 8,
-        "total_api_keys": global_stats["api_keys_active"],
-        "countries": countries,
-        "recent_requests": [
-            {"name": "Internal Nexus", "email": "system@gistly.site", "type": "Shield Active", "created_at": datetime.now().isoformat()}
-        ]
-    }
 
+job_queue = JobQueue(JOB_DB, JOB_WORKERS, JOB_QUEUE_MAX, JOB_RESULT_TTL)
 
-class CustomerRequest(BaseModel):
-    name: str
-    email: str
-    request_type: str
-    details: str
 
+@background_service
+async def job_queue_service() -> None:
+    await job_queue.serve()
 
-class VisitorTrack(BaseModel):
-    ip: str = "unknown"
-    country: str = "unknown"
-    city: str = "unknown"
-    path: str = "/"
 
-class APIKeyCreate(BaseModel):
-    user_email: str
-    plan: str = "free"  # free, pro, enterprise
+async def run_youtube_job(content: str, progress: Callable[[str], None]) -> str:
+    progress("fetching transcript")
+    return await summarize_youtube_url(content.strip())
 
-class APIKeyStatus(BaseModel):
-    api_key: str
 
+async def run_image_job(content: str, progress: Callable[[str], None]) -> dict[str, str]:
+    progress("synthesizing")
+    digest, ext = await image_flights.do(flight_key("generate-image", content), lambda: synthesize_image(content))
+    return {"digest": digest, "ext": ext}
 
-@app.get("/")
-async def status():
-    return {"status": "online", "model": "gemini-1.5-pro"}
 
+def present_image_job(result: dict[str, str], request: Request) -> dict[str, Any]:
+    # URLs are signed when read, so a late poll still gets a fresh link
+    url, expires = signed_image_url(request, result["digest"], result["ext"])
+    return {"url": url, "expires_at": expires}
 
-async def ask_gemini(prompt: str):
-    """Internal function to call Gemini API."""
-    if not API_KEY:
-        raise Exception("Gemini API Key is not configured.")
-    response = model.generate_content(prompt)
-    if not response.text:
-        raise Exception("Gemini returned an empty response.")
-    return response.text
 
+job_queue.register(JobKind("youtube-summarizer", run_youtube_job))
+job_queue.register(JobKind("generate-image", run_image_job, present_image_job))
 
-async def ask_groq(prompt: str):
-    """Internal function to call Groq API (Fallback)."""
-    if not groq_client:
-        raise Exception("Groq API Key is not configured.")
-    completion = groq_client.chat.completions.create(
-        model="llama3-8b-8192",
-        messages=[{"role": "user", "content": prompt}],
-    )
-    return completion.choices[0].message.content
 
+class JobRequest(BaseModel):
+    kind: str
+    content: str
 
-async def generate_ai_response(prompt: str):
-    """Unified AI interface with automatic fallback across providers."""
-    errors = []
 
-    # Provider 1: Gemini (Primary)
-    try:
-        return await ask_gemini(prompt)
-    except Exception as e:
-        error_msg = f"Gemini failed: {str(e)}"
-        print(error_msg)
-        errors.append(error_msg)
+@app.post("/api/jobs", status_code=202)
+async def submit_job(req: JobRequest, request: Request):
+    job = await job_queue.submit(req.kind, req.content, await current_plan())
+    base = f"{public_base_url(request)}/api/jobs/{job['job_id']}"
+    return {**job, "status_url": base, "events_url": f"{base}/events"}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, request: Request):
+    job = await job_queue.get(job_id, request)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job(job_id: str, request: Request):
+    return StreamingResponse(job_queue.events(job_id, request), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# --- Article Store ---
+# Scraping endpoints read pages through here. URLs are canonicalised (tracking
+# params stripped) and redirect chains are memoized, so repeated Google News
+# links go straight to the article. Extracted text, not raw HTML, is kept in
+# SQLite with its validators; a stale entry is revalidated with a conditional
+# GET, so a hot article costs one upstream fetch per ARTICLE_TTL window.
+ARTICLE_STORE_DB = os.getenv("ARTICLE_STORE_DB", os.path.join(DATA_DIR, "articles.sqlite3"))
+ARTICLE_TTL = int(os.getenv("ARTICLE_TTL", "1800"))
+ARTICLE_RETAIN = int(os.getenv("ARTICLE_RETAIN", str(7 * 86400)))
+ARTICLE_REDIRECT_TTL = int(os.getenv("ARTICLE_REDIRECT_TTL", str(7 * 86400)))
+ARTICLE_STORE_MAX_BYTES = int(os.getenv("ARTICLE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+ARTICLE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept": "text/html",
+}
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+    "ref", "ref_src", "ref_url", "_ga", "_gl", "spm", "cmpid", "ocid", "smid", "guccounter",
+}
 
-    # Provider 2: Groq (Fallback)
-    try:
-        if groq_client:
-            print("Attempting fallback to Groq...")
-            return await ask_groq(prompt)
-    except Exception as e:
-        error_msg = f"Groq fallback failed: {str(e)}"
-        print(error_msg)
-        errors.append(error_msg)
 
-    # If all providers fail
-    raise HTTPException(
-        status_code=500,
-        detail=f"All AI providers failed. Diagnostics: {'; '.join(errors)}",
+def canonical_url(url: str) -> str:
+    """Normalise a URL so equivalent links share one store entry."""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = (parts.scheme or "http").lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value)
+        for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
     )
+    return urllib.parse.urlunsplit((scheme, host, parts.path or "/", urllib.parse.urlencode(query), ""))
+
+
+class ArticleStore:
+    """Extracted page text keyed by (canonical URL, extractor), with HTTP revalidation."""
+
+    def __init__(self, path: str, ttl: int, retain: int, max_bytes: int):
+        self.path = path
+        self.ttl = ttl
+        self.retain = retain
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "revalidated": 0, "fetched": 0, "stale_served": 0, "redirects_memoized": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._writes_since_trim = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                "url TEXT, extractor TEXT, text TEXT, etag TEXT, last_modified TEXT, "
+                "size INTEGER, fetched_at REAL, expires_at REAL, accessed_at REAL, "
+                "PRIMARY KEY (url, extractor))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS articles_accessed ON articles(accessed_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS redirects (source TEXT PRIMARY KEY, target TEXT, expires_at REAL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _resolve(self, url: str) -> str:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT target FROM redirects WHERE source = ? AND expires_at > ?", (url, time.time())
+            ).fetchone()
+        return row[0] if row else url
+
+    def _lookup(self, url: str, extractor: str) -> dict[str, Any] | None:
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT text, etag, last_modified, expires_at FROM articles WHERE url = ? AND extractor = ?",
+                (url, extractor),
+            ).fetchone()
+            if not row:
+                return None
+            db.execute(
+                "UPDATE articles SET accessed_at = ? WHERE url = ? AND extractor = ?",
+                (time.time(), url, extractor),
+            )
+            db.commit()
+        return {"text": row[0], "etag": row[1], "last_modified": row[2], "expires_at": row[3]}
+
+    def _touch(self, url: str, extractor: str):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "UPDATE articles SET expires_at = ?, accessed_at = ? WHERE url = ? AND extractor = ?",
+                (now + self.ttl, now, url, extractor),
+            )
+            db.commit()
+
+    def _store(self, source: str, url: str, extractor: str, text: str, etag: str | None, last_modified: str | None):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            if source != url:
+                db.execute(
+                    "INSERT OR REPLACE INTO redirects (source, target, expires_at) VALUES (?, ?, ?)",
+                    (source, url, now + ARTICLE_REDIRECT_TTL),
+                )
+                self.stats["redirects_memoized"] += 1
+            db.execute(
+                "INSERT OR REPLACE INTO articles "
+                "(url, extractor, text, etag, last_modified, size, fetched_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, extractor, text, etag, last_modified, len(text.encode("utf-8")), now, now + self.ttl, now),
+            )
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 50:
+                self._writes_since_trim = 0
+                self._trim(db, now)
+            db.commit()
+
+    def _trim(self, db: sqlite3.Connection, now: float):
+        removed = db.execute("DELETE FROM articles WHERE expires_at < ?", (now - self.retain,)).rowcount
+        db.execute("DELETE FROM redirects WHERE expires_at < ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM articles").fetchone()[0]
+        if total > self.max_bytes:
+            for url, extractor, size in db.execute(
+                "SELECT url, extractor, size FROM articles ORDER BY accessed_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM articles WHERE url = ? AND extractor = ?", (url, extractor))
+                total -= size
+                removed += 1
+        self.stats["evicted"] += max(removed, 0)
+
+    async def fetch(self, url: str, extractor: str, timeout: float = 15) -> str:
+        """Extracted text of `url`, from the store while fresh, revalidated or refetched otherwise."""
+        source = canonical_url(url)
+        target = await asyncio.to_thread(self._resolve, source)
+        # Text from one backend is not reused by another
+        variant = f"{extractor}/{resolve_article_backend()}"
+        return await scrape_flights.do(
+            flight_key("article", variant, target),
+            lambda: self._fetch(source, target, extractor, variant, timeout),
+        )
 
+    async def _fetch(self, source: str, target: str, extractor: str, variant: str, timeout: float) -> str:
+        cached = await asyncio.to_thread(self._lookup, target, variant)
+        if cached and cached["expires_at"] > time.time():
+            self.stats["hits"] += 1
+            return cached["text"]
+
+        headers = dict(ARTICLE_HEADERS)
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            response = await outbound.get(target, headers=headers, timeout=timeout)
+            if response.status_code == 304 and cached:
+                await asyncio.to_thread(self._touch, target, variant)
+                self.stats["revalidated"] += 1
+                return cached["text"]
+            response.raise_for_status()
+        except httpx.HTTPError:
+            if cached:
+                self.stats["stale_served"] += 1
+                return cached["text"]
+            raise
+
+        final = canonical_url(str(response.url))
+        text = await cpu_pool.run(extract_article_text, response.content, extractor, resolve_article_backend())
+        await asyncio.to_thread(
+            self._store,
+            source,
+            final,
+            variant,
+            text,
+            response.headers.get("etag"),
+            response.headers.get("last-modified"),
+        )
+        self.stats["fetched"] += 1
+        return text
 
-@app.post("/api/summarize")
-async def summarize(req: AIRequest):
-    prompt = f"Summarize the following text concisely. Focus on the key takeaways:\n\n{req.content}"
-    result = await generate_ai_response(prompt)
-    return {"result": result}
-
-
-@app.post("/api/debug")
-async def debug_code(req: AIRequest):
-    prompt = (
-        f"Identify bugs and provide a fix for the following code. "
-        f"Explain why the bug occurred.\n\nCode:\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+    def snapshot(self) -> dict[str, Any]:
+        return dict(self.stats)
 
 
-@app.post("/api/humanize")
-async def humanize(req: AIRequest):
-    prompt = (
-        f"Rewrite the following text to sound more natural, human, and conversational. "
-        f"Avoid generic AI patterns while maintaining the original meaning:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+article_store = ArticleStore(ARTICLE_STORE_DB, ARTICLE_TTL, ARTICLE_RETAIN, ARTICLE_STORE_MAX_BYTES)
 
 
-@app.post("/api/resume-optimize")
-async def optimize_resume(req: AIRequest):
-    prompt = (
-        f"Analyze this resume content and suggest optimizations for ATS (Applicant Tracking Systems). "
-        f"Highlight keyword improvements and formatting suggestions:\n\n{req.content}"
+@app.post("/api/webpage-summarizer")
+async def summarize_webpage(req: AIRequest):
+    url = req.content.strip()
+    return await scrape_flights.do(
+        flight_key("webpage-summarizer", url), lambda: summarize_webpage_url(url)
     )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
 
 
-@app.post("/api/sql-generate")
-async def generate_sql(req: AIRequest):
-    prompt = (
-        f"Generate a well-optimized SQL query based on this natural language description. "
-        f"Assume standard relational database schemas:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
-
+async def summarize_webpage_url(url: str):
+    try:
+        content = await article_store.fetch(url, "webpage", timeout=10)
+        return {"result": await summarize_webpage_content(content)}
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Failed to fetch webpage: {str(e)}"
+        )
 
-@app.post("/api/social-post")
-async def generate_social(req: AIRequest):
-    prompt = (
-        f"Generate highly engaging social media posts for Twitter, LinkedIn, and Instagram "
-        f"based on this topic or content:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
 
+async def summarize_webpage_content(content: str) -> str:
+    if not content.strip():
+        return "Could not extract readable text from this webpage."
 
-@app.post("/api/email-gen")
-async def generate_email(req: AIRequest):
-    prompt = (
-        f"Write a professional and highly effective email based on the following context. "
-        f"Ensure the tone is appropriate for a business setting:\n\n{req.content}"
+    prompt_template = (
+        "Please provide a clear and concise summary of the following webpage content. "
+        "Highlight the main points and key takeaways:\n\n{content}"
     )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+    return await summarize_long_text(content, prompt_template, "webpage-summarizer")
+
+
+# --- Webpage Batch Summarization ---
+# Many URLs in one call: pages are fetched concurrently (at most
+# WEBPAGE_BATCH_PER_HOST at a time per host, on top of the client-wide cap),
+# extracted in the CPU pool and summarized as they arrive, so total latency
+# tracks the slowest page rather than the sum. An optional digest merges the
+# per-page summaries at the end.
+WEBPAGE_BATCH_MAX_URLS = int(os.getenv("WEBPAGE_BATCH_MAX_URLS", "25"))
+WEBPAGE_BATCH_PER_HOST = int(os.getenv("WEBPAGE_BATCH_PER_HOST", "2"))
+WEBPAGE_DIGEST_TEMPLATE = (
+    "Combine the following webpage summaries into one digest. Group related points, call out where sources "
+    "agree or disagree, and cite each source URL where it is used:\n\n{content}"
+)
 
 
-@app.post("/api/regex-gen")
-async def generate_regex(req: AIRequest):
-    prompt = (
-        f"Create a Regular Expression (Regex) for the following natural language description. "
-        f"Provide the regex pattern and a brief explanation of how it works:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+class WebpageBatchRequest(BaseModel):
+    urls: List[str]
+    digest: bool = False
+    stream: bool = False
 
 
-@app.post("/api/cover-letter")
-async def generate_cover_letter(req: AIRequest):
-    prompt = (
-        f"Write a compelling and professional cover letter based on the following details "
-        f"(job description, personal experience, etc.). Highlight key strengths:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+async def summarize_batch_page(index: int, url: str, host_slots: dict[str, asyncio.Semaphore]):
+    """Fetch under the host's politeness slot, then summarize; failures become per-URL errors."""
+    entry: dict[str, Any] = {"index": index, "url": url}
+    host = urllib.parse.urlsplit(url).hostname or ""
+    try:
+        async with host_slots.setdefault(host, asyncio.Semaphore(WEBPAGE_BATCH_PER_HOST)):
+            content = await article_store.fetch(url, "webpage", timeout=10)
+        entry["result"] = await summarize_webpage_content(content)
+    except HTTPException as e:
+        entry.update(error=e.detail, status_code=e.status_code)
+    except Exception as e:
+        entry.update(error=f"Failed to fetch webpage: {str(e)}", status_code=500)
+    return entry
 
 
-@app.post("/api/grammar-fix")
-async def fix_grammar(req: AIRequest):
-    prompt = (
-        f"Act as a professional proofreader. Fix any grammar, spelling, or punctuation errors "
-        f"in the following text. Also, suggest improvements to make it sound more professional:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+async def webpage_digest(entries: list[dict[str, Any]]) -> str | None:
+    summaries = [f"Source: {e['url']}\n{e['result']}" for e in sorted(entries, key=lambda e: e["index"]) if "result" in e]
+    if not summaries:
+        return None
+    return await summarize_long_text("\n\n".join(summaries), WEBPAGE_DIGEST_TEMPLATE, "webpage-digest")
 
 
-@app.post("/api/business-validator")
-async def validate_business(req: AIRequest):
-    prompt = (
-        f"Act as an expert startup advisor. Analyze the following business idea. "
-        f"Provide a structured report including: 1) Pros, 2) Cons, 3) Target Audience, "
-        f"and 4) Competitive Analysis:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+@app.post("/api/webpage-summarizer/batch")
+async def summarize_webpage_batch(req: WebpageBatchRequest, request: Request):
+    """Summarize several pages at once.
 
+    Results come back in input order, or as SSE `item` events in completion
+    order when `stream` is set, followed by `digest` (if asked for) and `done`.
+    A failed digest never costs the per-page results: it is reported as
+    `digest_error` (or an SSE `error` event) alongside them.
+    """
+    urls = list(dict.fromkeys(url.strip() for url in req.urls if url.strip()))
+    if not urls:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one URL.")
+    if len(urls) > WEBPAGE_BATCH_MAX_URLS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {WEBPAGE_BATCH_MAX_URLS} URLs.")
 
-@app.post("/api/blog-gen")
-async def generate_blog(req: AIRequest):
-    prompt = (
-        f"Write a comprehensive, engaging, and SEO-optimized blog post based on the following topic or outline. "
-        f"Include an engaging title, introduction, body paragraphs with headings, and a conclusion:\n\n{req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+    api_key = request.headers.get("X-API-KEY")
+    if api_key:
+        status = await validate_api_key(api_key, credits=float(len(urls)), endpoint="webpage_batch")
+        if status == "insufficient_balance":
+            raise HTTPException(status_code=402, detail="Insufficient credits for this batch.")
+        if not status:
+            raise HTTPException(status_code=401, detail="Invalid or inactive API key.")
 
+    host_slots: dict[str, asyncio.Semaphore] = {}
+    tasks = [asyncio.create_task(summarize_batch_page(i, url, host_slots)) for i, url in enumerate(urls)]
 
-@app.post("/api/youtube-summarizer")
-async def summarize_youtube(req: AIRequest):
-    if not apify_client:
-        raise HTTPException(
-            status_code=500,
-            detail="APIFY_API_TOKEN not found. Please add it to your .env file to enable YouTube summaries.",
-        )
+    if not req.stream:
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            # A client disconnect cancels this handler; don't leave the fetches running
+            for task in tasks:
+                task.cancel()
+        body: dict[str, Any] = {"results": results}
+        if req.digest:
+            try:
+                body["digest"] = await webpage_digest(results)
+            except HTTPException as e:
+                body["digest_error"] = e.detail
+            except Exception as e:
+                body["digest_error"] = f"Digest failed: {str(e)}"
+        return body
+
+    async def events():
+        finished = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                entry = await next_done
+                finished.append(entry)
+                yield sse_event("item", entry)
+            if req.digest:
+                try:
+                    yield sse_event("digest", {"result": await webpage_digest(finished)})
+                except HTTPException as e:
+                    yield sse_event("error", {"detail": e.detail})
+                except Exception as e:
+                    yield sse_event("error", {"detail": f"Digest failed: {str(e)}"})
+            yield sse_event("done", {"count": len(tasks)})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# --- Speech Synthesis ---
+# gTTS renders straight into memory; clips are cached by (text, lang, slow)
+# in a byte-bounded LRU, with an optional on-disk tier shared across workers
+# and restarts. Set TTS_CACHE_DIR to an empty string to keep it memory-only.
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(DATA_DIR, "tts"))
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+
+def render_speech(text: str, lang: str, slow: bool) -> bytes:
+    buffer = io.BytesIO()
+    gTTS(text=text, lang=lang, slow=slow).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+class SpeechCache:
+    """LRU of synthesized MP3 clips, bounded by bytes, with an optional disk tier."""
+
+    def __init__(self, memory_bytes: int, directory: str | None, disk_bytes: int):
+        self.memory_bytes = memory_bytes
+        self.directory = directory or None
+        self.disk_bytes = disk_bytes
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_size = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "synth_seconds": 0.0}
+        self._writes_since_trim = 0
+
+    @staticmethod
+    def make_key(text: str, lang: str, slow: bool) -> str:
+        return hashlib.sha256(f"{lang}\x00{int(slow)}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _remember(self, key: str, audio: bytes):
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        self.memory[key] = audio
+        self.memory_size += len(audio)
+        while self.memory_size > self.memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def _disk_get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # mtime doubles as the LRU clock
+        return audio
+
+    def _disk_put(self, key: str, audio: bytes):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(audio)
+        os.replace(temp_path, target)
+        self._writes_since_trim += 1
+        if self._writes_since_trim >= 50:
+            self._writes_since_trim = 0
+            self._trim()
+
+    def _trim(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".mp3"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> bytes | None:
+        audio = self.memory.get(key)
+        if audio is not None:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return audio
+        if self.directory:
+            try:
+                audio = await asyncio.to_thread(self._disk_get, key)
+            except Exception as e:
+                print(f"TTS cache read error: {e}")
+            if audio is not None:
+                self._remember(key, audio)
+                self.stats["disk_hits"] += 1
+                return audio
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, audio: bytes):
+        self._remember(key, audio)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._disk_put, key, audio)
+            except Exception as e:
+                print(f"TTS cache write error: {e}")
 
-    try:
-        url = req.content.strip()
-
-        # Call Apify Actor
-        # Using streamers/youtube-scraper which is highly reliable
-        run_input = {
-            "downloadSubtitles": True,
-            "saveSubsToItems": True,
-            "startUrls": [{"url": url}],
-            "maxResults": 1,
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            **self.stats,
+            "synth_seconds": round(self.stats["synth_seconds"], 3),
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_size,
+            "disk_tier": bool(self.directory),
         }
 
-        # Run the actor and wait for it to finish
-        run = apify_client.actor("streamers/youtube-scraper").call(run_input=run_input)
-        if not run:
-            raise Exception("Apify actor run failed to return data.")
-
-        transcript_parts: list[str] = []
-        # Fetch results from the dataset
-        for item in apify_client.dataset(run["defaultDatasetId"]).iterate_items():
-            if "transcript" in item:
-                transcript_parts.append(str(item.get("transcript", "")))
-                break
-            elif "text" in item and item["text"]:
-                transcript_parts.append(str(item.get("text", "")) + " ")
 
-        transcript_text = "".join(transcript_parts)
+speech_cache = SpeechCache(TTS_CACHE_MEMORY_BYTES, TTS_CACHE_DIR, TTS_CACHE_DISK_BYTES)
+tts_flights = SingleFlight("tts")
+
+
+async def synthesize_speech(text: str, lang: str = "en", slow: bool = False) -> bytes:
+    """MP3 bytes for `text`, from cache when possible; gTTS runs on the TTS pool."""
+    key = SpeechCache.make_key(text, lang, slow)
+    audio = await speech_cache.get(key)
+    if audio is not None:
+        return audio
+
+    async def compute() -> bytes:
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(tts_executor, render_speech, text, lang, slow)
+        speech_cache.stats["synth_seconds"] += time.monotonic() - started
+        await speech_cache.set(key, rendered)
+        return rendered
+
+    return await tts_flights.do(key, compute)
+
+
+# Long texts are split at sentence boundaries and rendered chunk by chunk on a
+# dedicated pool; the chunks' MP3 frames concatenate into one playable stream,
+# so audio can be sent as soon as the first sentence is ready.
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "280"))
+TTS_MAX_WORKERS = int(os.getenv("TTS_MAX_WORKERS", "8"))
+TTS_PIPELINE_WINDOW = int(os.getenv("TTS_PIPELINE_WINDOW", str(TTS_MAX_WORKERS * 2)))
+TTS_STREAM_MIN_CHARS = int(os.getenv("TTS_STREAM_MIN_CHARS", "400"))
+tts_executor = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+
+
+def speech_chunks(text: str, max_chars: int = TTS_CHUNK_CHARS) -> list[str]:
+    """Sentence-aligned chunks; the first is a single sentence so playback starts early."""
+    chunks: list[str] = []
+    current = ""
+    for sentence in SENTENCE_BREAK.split(" ".join(text.split())):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if current and (len(current) + 1 + len(sentence) > max_chars or len(chunks) == 0):
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def speech_pipeline(text: str, lang: str = "en", slow: bool = False):
+    """Yield MP3 bytes chunk by chunk, in order, with up to TTS_PIPELINE_WINDOW renders in flight."""
+    pending = deque(speech_chunks(text))
+    in_flight: deque[asyncio.Task] = deque()
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < TTS_PIPELINE_WINDOW:
+                in_flight.append(asyncio.create_task(synthesize_speech(pending.popleft(), lang, slow)))
+            yield await in_flight.popleft()
+    finally:
+        for task in in_flight:
+            task.cancel()
 
-        if not transcript_text:
-            raise HTTPException(
-                status_code=400,
-                detail="Could not retrieve transcript. Ensure the video has captions available.",
-            )
 
-        prompt = (
-            f"Please provide a comprehensive summary with key takeaways of this YouTube video based on its transcript. "
-            f"Here is the transcript:\n\n{str(transcript_text)[:100000]}"
-        )
-        result = await generate_ai_response(prompt)
-        return {"result": result}
+async def speech_stream(text: str, lang: str = "en", slow: bool = False):
+    # Headers are already sent once audio flows, so a failed chunk ends the stream early
+    try:
+        async for audio in speech_pipeline(text, lang, slow):
+            yield audio
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Apify Error: {str(e)}")
+        print(f"TTS stream aborted: {e}")
 
 
-@app.post("/api/generate-image")
-async def generate_image_api(req: AIRequest):
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+async def synthesize_long_speech(text: str, lang: str = "en", slow: bool = False) -> bytes:
+    return b"".join([audio async for audio in speech_pipeline(text, lang, slow)])
 
-    # Phase 1: Prompt Optimization
-    try:
-        enhancer_prompt = f"Act as a professional image prompt engineer. Translate if needed and expand this to a detailed 1024x1024 safe stable diffusion prompt: {req.content}. Respond ONLY with the prompt itself, without any conversational filler or preambles."
-        raw_prompt = await generate_ai_response(enhancer_prompt)
-        prompt = raw_prompt.strip()
-    except Exception:
-        prompt = req.content.strip()
 
-    prompt_clean = re.sub(r"[^\x00-\x7f]", r"", prompt)
-    prompt_encoded = urllib.parse.quote(prompt_clean[:500])
-    errors = []
+# --- Binary Response Negotiation ---
+# Media endpoints answer with base64 JSON by default. Clients that send
+# `Accept: audio/mpeg` (or `image/*`) get the raw bytes instead, with the
+# JSON metadata moved into X-* headers (percent-encoded, as text may be non-ASCII).
+def accepts_media(request: Request, major_type: str) -> bool:
+    """True if the Accept header explicitly asks for some `major_type/*` media."""
+    for part in request.headers.get("accept", "").split(","):
+        if part.split(";")[0].strip().lower().startswith(f"{major_type}/"):
+            return True
+    return False
 
-    session = requests.Session()
 
-    # Provider Hierarchy: Fast Direct APIs -> Hugging Face -> Leonardo
-    providers: list[dict[str, Any]] = [
-        {
-            "name": "Pollinations High-Stability",
-            "url": f"https://image.pollinations.ai/prompt/{prompt_encoded}?width=1024&height=1024&nologo=true&model=flux",
-            "type": "direct",
-            "verify": True,
-        },
-        {
-            "name": "Airforce SDXL (Global)",
-            "url": f"https://api.airforce/v1/image-generation?model=stable-diffusion-xl&prompt={prompt_encoded}",
-            "type": "direct",
-            "verify": True,
-        },
-    ]
+def metadata_headers(metadata: dict[str, Any]) -> dict[str, str]:
+    return {
+        "X-" + "-".join(word.capitalize() for word in key.split("_")): urllib.parse.quote(str(value), safe="/:?=&")
+        for key, value in metadata.items()
+    }
 
-    # Add Hugging Face nodes if token is available
-    if HF_TOKEN:
-        hf_models = [
-            "black-forest-labs/FLUX.1-schnell",
-            "stabilityai/sdxl-turbo",
-            "stabilityai/stable-diffusion-xl-base-1.0",
-            "runwayml/stable-diffusion-v1-5",
-        ]
-        for m_id in hf_models:
-            providers.append(
-                {
-                    "name": f"Hugging Face ({m_id.split('/')[-1]})",
-                    # Using the new router endpoint to avoid 410 Gone
-                    "url": f"https://router.huggingface.co/hf-inference/models/{m_id}",
-                    "type": "hf",
-                    "headers": {"Authorization": f"Bearer {HF_TOKEN}"},
-                }
-            )
 
-    # Fallback nodes (Mirrors and Aggregators)
-    providers.extend(
-        [
-            {
-                "name": "Leonardo.ai (Premium Cluster)",
-                "type": "leonardo",
-                "key": LEONARDO_API_KEY,
-            },
-        ]
+async def audio_response(request: Request, audio: bytes, **metadata: Any):
+    """Raw MP3 for clients accepting audio, legacy base64 JSON otherwise."""
+    if accepts_media(request, "audio"):
+        return Response(content=audio, media_type="audio/mpeg", headers=metadata_headers(metadata))
+    # Encoded inline: base64 runs at ~2 ms/MiB, less than a round trip to the pool
+    return {"result": base64.b64encode(audio).decode("utf-8"), "is_audio": True, **metadata}
+
+
+# --- Overlapped Voice Pipeline ---
+# In stream mode the assistant answer is streamed from the LLM, the `lang|`
+# prefix is read from the first tokens, and each finished sentence is handed
+# to TTS while the model keeps generating, so audio starts after the first
+# sentence instead of after the whole answer.
+VOICE_LANG_PREFIX_MAX = 12
+VOICE_LANG_CODE = re.compile(r"^[a-z]{2,3}(-[a-zA-Z]{2,4})?$")
+voice_metrics = {"overlapped_calls": 0, "first_audio_total": 0.0, "first_audio_last": 0.0}
+
+
+def voice_assistant_prompt(text: str) -> str:
+    return (
+        f"You are the 'Gistly Universal Guardian', a world-class expert AI assistant. "
+        f"You are capable of solving any problem, generating breakthrough ideas, and researching complex topics. "
+        f"Respond concisely (under 60 words) but with maximum intelligence and value. "
+        f"IMPORTANT: Respond in the EXACT same language as the user's query. "
+        f"Your output MUST start with the ISO-639-1 language code of your response followed by a pipe symbol, "
+        f"then your response. Example: 'en|Hello, how can I help?' or 'si|ආයුබෝවන්, මම ඔබට කොහොමද උදව් කරන්නේ?'\n\n"
+        f"User Query: {text}"
     )
 
-    for provider in providers:
-        try:
-            print(f"Protocol [{provider['name']}] Synchronization...")
-            content: bytes | None = None
-
-            if provider["type"] == "hf":
-                # Hugging Face Inference Call - Dual Endpoint Strategy
-                payload = {"inputs": prompt}
-                endpoints = [
-                    str(provider.get("url", "")),  # New Router
-                    str(provider.get("url", "")).replace(
-                        "router.huggingface.co/hf-inference",
-                        "api-inference.huggingface.co",
-                    ),  # Legacy Fallback
-                ]
-
-                last_response = None
-                for ep_url in endpoints:
-                    try:
-                        response = session.post(
-                            ep_url,
-                            headers=provider.get("headers", {}),
-                            json=payload,
-                            timeout=60,
-                        )
-                        if response.status_code == 200:
-                            last_response = response
-                            break
-                        if response.status_code == 503:
-                            print(f"Model Loading on {ep_url}. Waiting 8s...")
-                            time.sleep(8)
-                            response = session.post(
-                                ep_url,
-                                headers=provider.get("headers", {}),
-                                json=payload,
-                                timeout=60,
-                            )
-                            if response.status_code == 200:
-                                last_response = response
-                                break
-                    except Exception:
-                        continue
-
-                if not last_response:
-                    raise Exception("Hugging Face failed all endpoint attempts.")
 
-                content = last_response.content
+async def speak_sentence(sentence: str, lang: str) -> bytes:
+    try:
+        return await synthesize_speech(sentence, lang)
+    except ValueError:
+        # Fallback to English synthesis if language code is unsupported by gTTS
+        return await synthesize_speech(sentence, "en")
 
-            elif provider["type"] == "leonardo":
-                provider_key = provider.get("key")
-                if not provider_key:
-                    raise Exception("Leonardo API Key missing.")
 
-                leo_headers = {
-                    "accept": "application/json",
-                    "content-type": "application/json",
-                    "authorization": f"Bearer {provider_key}",
-                }
+async def produce_voice_sentences(prompt: str, queue: asyncio.Queue):
+    """Feed `queue` with lang, sentence (text plus its TTS task), fallback, done and error items."""
+    lang: str | None = None
+    buffer = ""
 
-                # Start Generation
-                start_url = "https://cloud.leonardo.ai/api/rest/v1/generations"
-                payload = {
-                    "height": 512,
-                    "width": 512,
-                    "prompt": prompt,
-                    "num_images": 1,
-                }
-                response = session.post(
-                    start_url, json=payload, headers=leo_headers, timeout=30
-                )
-                gen_id = response.json().get("sdGenerationJob", {}).get("generationId")
-
-                if not gen_id:
-                    raise Exception("Leonardo failed to initiate job.")
-
-                # Poll for Result
-                poll_url = f"https://cloud.leonardo.ai/api/rest/v1/generations/{gen_id}"
-                for _ in range(10):  # Max 30 seconds
-                    time.sleep(3)
-                    resp = session.get(poll_url, headers=leo_headers)
-                    images = (
-                        resp.json()
-                        .get("generations_by_pk", {})
-                        .get("generated_images", [])
-                    )
-                    if images:
-                        target_url = images[0].get("url")
-                        img_resp = session.get(target_url, timeout=30)
-                        content = img_resp.content
-                        break
-
-                if not content:
-                    raise Exception("Leonardo job timed out.")
-
-            elif provider["type"] == "direct":
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-                    "Accept": "image/*",
-                    "Referer": "https://www.bing.com/",
-                }
-                provider_url = str(provider.get("url", ""))
-                provider_verify = bool(provider.get("verify", True))
-                response = session.get(
-                    provider_url,
-                    headers=headers,
-                    timeout=40,
-                    verify=provider_verify,
-                    allow_redirects=True,
-                )
-                response.raise_for_status()
-                content = response.content
-
-            # Binary Integrity Cluster Check
-            if not content or len(content) < 5000:
-                raise Exception("Provider payload too small/empty.")
-
-            # Check for Image Magic Bytes (Flexible)
-            signature = content[:10]
-            is_image = (
-                signature.startswith(b"\xff\xd8")  # JPG
-                or signature.startswith(b"\x89PNG")  # PNG
-                or signature.startswith(b"RIFF")  # WebP
-                or signature.startswith(b"GIF")  # GIF
-            )
+    async def emit(sentence: str):
+        sentence = sentence.strip()
+        if sentence:
+            await queue.put(("sentence", sentence, asyncio.create_task(speak_sentence(sentence, lang))))
 
-            if not is_image:
-                # If it's a JSON response from an API that returns a URL (like Hercai)
-                try:
-                    data = json.loads(content)
-                    if "url" in data:
-                        resp = session.get(data["url"], timeout=30)
-                        content = resp.content
+    try:
+        async for event, payload in stream_ai_response(prompt, tool="voice-assistant"):
+            if event == "token":
+                buffer += payload["text"]
+                if lang is None:
+                    head, sep, rest = buffer.partition("|")
+                    if sep and VOICE_LANG_CODE.match(head.strip()):
+                        lang, buffer = head.strip(), rest
+                    elif sep or len(buffer) > VOICE_LANG_PREFIX_MAX:
+                        lang = "en"  # Fallback if AI forgets format
                     else:
-                        raise Exception("Not an image and no URL in JSON.")
-                except Exception:
-                    raise Exception(
-                        "Binary signature mismatch (Likely Cloudflare Challenge/HTML)."
-                    )
-
-            encoded_image = base64.b64encode(content).decode("utf-8")
-            print(f"Synthesis [{provider['name']}] SUCCESSFUL.")
-            return {"result": encoded_image, "is_base64": True}
-
-        except Exception as e:
-            print(f"Failover Protocol: {provider['name']} - {str(e)[:150]}")
-            errors.append(f"{provider['name']} ({str(e)[:40]})")
-            time.sleep(2)  # Throttle before next node
-            continue
+                        continue
+                    await queue.put(("lang", lang))
+                *finished, buffer = SENTENCE_BREAK.split(buffer)
+                for sentence in finished:
+                    await emit(sentence)
+            elif event == "fallback":
+                # The next provider restarts the answer, language prefix included
+                lang, buffer = None, ""
+                await queue.put(("fallback", payload))
+            elif event == "done":
+                if lang is None:
+                    lang = "en"
+                    await queue.put(("lang", lang))
+                await emit(buffer)
+                await queue.put(("done", payload))
+    except HTTPException as e:
+        await queue.put(("error", e.detail))
+    except Exception as e:
+        await queue.put(("error", str(e)))
+    finally:
+        await queue.put(None)
 
-    raise HTTPException(
-        status_code=500,
-        detail=f"Global synthesis failure. Cluster exhausted. Logs: {'; '.join(errors)}",
-    )
 
+async def overlapped_voice_events(prompt: str):
+    """Yield `(event, payload)` in speaking order: lang, audio per sentence, fallback, done, error.
 
-@app.post("/api/webpage-summarizer")
-async def summarize_webpage(req: AIRequest):
+    A `fallback` restarts the answer: its `discard_audio` flag tells clients to
+    drop the sentences already played, and a fresh `lang` event follows.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.create_task(produce_voice_sentences(prompt, queue))
+    started = time.monotonic()
+    first_audio: float | None = None
+    spoken: list[str] = []
+    lang = "en"
+    pending_tasks: list[asyncio.Task] = []
     try:
-        url = req.content.strip()
-        headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        while (item := await queue.get()) is not None:
+            kind = item[0]
+            if kind == "lang":
+                lang = item[1]
+                yield "lang", {"detected_lang": lang}
+            elif kind == "sentence":
+                _, sentence, task = item
+                pending_tasks.append(task)
+                try:
+                    audio = await task
+                except Exception as e:
+                    yield "error", {"detail": f"Speech synthesis failed: {e}"}
+                    return
+                if first_audio is None:
+                    first_audio = time.monotonic() - started
+                    voice_metrics["overlapped_calls"] += 1
+                    voice_metrics["first_audio_total"] += first_audio
+                    voice_metrics["first_audio_last"] = first_audio
+                    print(f"VOICE FIRST AUDIO: TTFA={first_audio:.2f}s")
+                spoken.append(sentence)
+                yield "audio", {"text": sentence, "audio": audio}
+            elif kind == "fallback":
+                for task in pending_tasks:
+                    task.cancel()
+                pending_tasks.clear()
+                yield "fallback", {**item[1], "discard_audio": bool(spoken)}
+                spoken.clear()
+            elif kind == "done":
+                yield "done", {
+                    "text_response": " ".join(spoken),
+                    "detected_lang": lang,
+                    "provider": item[1].get("provider"),
+                    "time_to_first_audio": round(first_audio or 0.0, 3),
+                }
+            elif kind == "error":
+                yield "error", {"detail": item[1]}
+    finally:
+        producer.cancel()
+        for task in pending_tasks:
+            task.cancel()
 
-        soup = BeautifulSoup(response.content, "html.parser")
 
-        # Extract text from p, h1, h2, h3, li
-        texts = soup.find_all(["p", "h1", "h2", "h3", "li"])
-        content = " ".join([t.get_text() for t in texts])
+def voice_metrics_snapshot() -> dict[str, Any]:
+    calls = voice_metrics["overlapped_calls"]
+    return {
+        "overlapped_calls": calls,
+        "avg_time_to_first_audio": round(voice_metrics["first_audio_total"] / calls, 3) if calls else 0.0,
+        "last_time_to_first_audio": round(voice_metrics["first_audio_last"], 3),
+    }
 
-        if not content.strip():
-            return {"result": "Could not extract readable text from this webpage."}
 
-        prompt = (
-            f"Please provide a clear and concise summary of the following webpage content. "
-            f"Highlight the main points and key takeaways:\n\n{content[:100000]}"
-        )
-        result = await generate_ai_response(prompt)
-        return {"result": result}
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Failed to fetch webpage: {str(e)}"
+async def overlapped_voice_response(prompt: str, request: Request):
+    """Raw chunked MP3 for audio clients, SSE with base64 sentence audio otherwise."""
+    events = overlapped_voice_events(prompt)
+
+    if accepts_media(request, "audio"):
+        # Hold the response until the language is known so it can go in the headers.
+        # A fallback before then has voiced nothing; the next provider's `lang` follows.
+        lang = "en"
+        async for event, payload in events:
+            if event == "error":
+                await events.aclose()
+                raise HTTPException(status_code=500, detail=payload["detail"])
+            if event == "lang":
+                lang = payload["detected_lang"]
+                break
+
+        async def audio_stream():
+            async for event, payload in events:
+                if event == "audio":
+                    yield payload["audio"]
+                elif event == "error":
+                    print(f"Voice stream aborted: {payload['detail']}")
+                    return
+                elif event == "fallback" and payload["discard_audio"]:
+                    # Played audio cannot be taken back, so end rather than voice a second answer
+                    print("Voice stream aborted: provider fell back after audio was sent")
+                    return
+
+        return StreamingResponse(
+            audio_stream(),
+            media_type="audio/mpeg",
+            headers=metadata_headers({"detected_lang": lang, "engine": "Nexus Aegis v3 (Universal Guardian)"}),
         )
 
+    async def sse_stream():
+        async for event, payload in events:
+            if event == "audio":
+                payload = {"text": payload["text"], "audio": base64.b64encode(payload["audio"]).decode("utf-8")}
+            yield sse_event(event, payload)
+
+    return StreamingResponse(sse_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 
 @app.post("/api/voice-assistant")
-async def voice_assistant(req: AIRequest):
+async def voice_assistant(req: AIRequest, request: Request, stream: bool = False):
     try:
         text = req.content.strip()
         if not text:
             raise HTTPException(status_code=400, detail="Input is required for Nexus Guardian")
 
         # Phase 1: Universal Guardian Intelligence
-        assistant_prompt = (
-            f"You are the 'Gistly Universal Guardian', a world-class expert AI assistant. "
-            f"You are capable of solving any problem, generating breakthrough ideas, and researching complex topics. "
-            f"Respond concisely (under 60 words) but with maximum intelligence and value. "
-            f"IMPORTANT: Respond in the EXACT same language as the user's query. "
-            f"Your output MUST start with the ISO-639-1 language code of your response followed by a pipe symbol, "
-            f"then your response. Example: 'en|Hello, how can I help?' or 'si|ආයුබෝවන්, මම ඔබට කොහොමද උදව් කරන්නේ?'\n\n"
-            f"User Query: {text}"
-        )
-        
-        raw_response = await generate_ai_response(assistant_prompt)
+        assistant_prompt = voice_assistant_prompt(text)
+        if stream:
+            return await overlapped_voice_response(assistant_prompt, request)
+
+        raw_response = await generate_ai_response(assistant_prompt, tool="voice-assistant")
         
         # Phase 2: Linguistic Extraction
         try:
@@ -738,28 +3834,18 @@ async def voice_assistant(req: AIRequest):
         # Phase 3: Adaptive Neural Synthesis
         # gTTS supports many languages. We'll map the detected code.
         try:
-            tts = gTTS(text=response_text, lang=lang_code, slow=False)
-        except Exception:
+            audio = await synthesize_speech(response_text, lang_code)
+        except ValueError:
             # Fallback to English synthesis if language code is unsupported by gTTS
-            tts = gTTS(text=response_text, lang="en", slow=False)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-            temp_path = fp.name
-
-        tts.save(temp_path)
-
-        with open(temp_path, "rb") as audio_file:
-            encoded_audio = base64.b64encode(audio_file.read()).decode("utf-8")
-
-        os.remove(temp_path)
-
-        return {
-            "result": encoded_audio, 
-            "is_audio": True,
-            "text_response": response_text,
-            "detected_lang": lang_code,
-            "engine": "Nexus Aegis v3 (Universal Guardian)"
-        }
+            audio = await synthesize_speech(response_text, "en")
+
+        return await audio_response(
+            request,
+            audio,
+            text_response=response_text,
+            detected_lang=lang_code,
+            engine="Nexus Aegis v3 (Universal Guardian)",
+        )
 
     except Exception as e:
         raise HTTPException(
@@ -768,7 +3854,7 @@ async def voice_assistant(req: AIRequest):
 
 
 @app.post("/api/voice-clone")
-async def voice_clone(req: AIRequest):
+async def voice_clone(req: AIRequest, request: Request):
     try:
         text = req.content.strip()
         if not text:
@@ -779,27 +3865,17 @@ async def voice_clone(req: AIRequest):
         
         # Phase 1: Neural Optimization (Content smoothing)
         optimize_prompt = f"Rewrite this text to be perfect for a natural human voice, adding subtle pauses where appropriate: {text}"
-        optimized_text = await generate_ai_response(optimize_prompt)
+        optimized_text = await generate_ai_response(optimize_prompt, tool="voice-clone")
         
         # Phase 2: Synthesis
-        tts = gTTS(text=optimized_text, lang="en", slow=False)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-            temp_path = fp.name
-
-        tts.save(temp_path)
-
-        with open(temp_path, "rb") as audio_file:
-            encoded_audio = base64.b64encode(audio_file.read()).decode("utf-8")
-
-        os.remove(temp_path)
+        audio = await synthesize_long_speech(optimized_text, "en")
 
-        return {
-            "result": encoded_audio, 
-            "is_audio": True,
-            "engine": "Nexus Aegis v1 (Neural Clone)",
-            "confidence": 0.98
-        }
+        return await audio_response(
+            request,
+            audio,
+            engine="Nexus Aegis v1 (Neural Clone)",
+            confidence=0.98,
+        )
 
     except Exception as e:
         raise HTTPException(
@@ -808,25 +3884,19 @@ async def voice_clone(req: AIRequest):
 
 
 @app.post("/api/tts")
-async def generate_speech(req: AIRequest):
+async def generate_speech(req: AIRequest, request: Request):
     try:
         text = req.content.strip()
         if not text:
             raise HTTPException(status_code=400, detail="Text is required for TTS")
 
-        tts = gTTS(text=text, lang="en", slow=False)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as fp:
-            temp_path = fp.name
+        # Long text played by an audio client starts streaming after the first sentence
+        if len(text) >= TTS_STREAM_MIN_CHARS and accepts_media(request, "audio"):
+            return StreamingResponse(speech_stream(text, "en"), media_type="audio/mpeg")
 
-        tts.save(temp_path)
+        audio = await synthesize_long_speech(text, "en")
 
-        with open(temp_path, "rb") as audio_file:
-            encoded_audio = base64.b64encode(audio_file.read()).decode("utf-8")
-
-        os.remove(temp_path)
-
-        return {"result": encoded_audio, "is_audio": True}
+        return await audio_response(request, audio)
 
     except Exception as e:
         raise HTTPException(
@@ -901,17 +3971,18 @@ async def load_workflow(workflow_id: str):
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
-@app.post("/api/vision")
-async def analyze_image(req: AIRequest):
-    # This is a placeholder for the Vision API as it requires handling file uploads or base64
-    # The frontend will eventually send the image data to this endpoint.
-    # Currently just sending text for testing if we wanted, but full vision needs more logic
-    prompt = (
-        f"You are given an image. Please describe what is in the main focus of the scene. "
-        f"Context provided by user: {req.content}"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
+async def fetch_feed_source(src: dict[str, str]) -> list[dict[str, str]]:
+    try:
+        resp = await outbound.get(src["url"], timeout=5)
+        return await cpu_pool.run(parse_feed_entries, resp.content, src["name"])
+    except Exception:
+        return []
+
+
+async def collect_feed_articles(sources: list[dict[str, str]], limit: int = 40) -> list[dict[str, str]]:
+    results = await asyncio.gather(*(fetch_feed_source(src) for src in sources))
+    all_articles = [item for sublist in results for item in sublist]
+    return all_articles[:limit]
 
 
 @app.get("/api/news")
@@ -924,27 +3995,7 @@ async def get_news_feed():
             {"url": "https://rss.nytimes.com/services/xml/rss/nyt/World.xml", "name": "NY Times"}
         ]
         
-        def fetch_source(src):
-            try:
-                resp = requests.get(src["url"], timeout=5)
-                feed = feedparser.parse(resp.content)
-                items = []
-                for entry in feed.entries[:10]:
-                    items.append({
-                        "title": entry.title,
-                        "link": entry.link,
-                        "published": entry.get('published', ''),
-                        "source": src["name"]
-                    })
-                return items
-            except Exception:
-                return []
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(fetch_source, sources))
-        
-        all_articles = [item for sublist in results for item in sublist]
-        return {"articles": all_articles[:40]}
+        return {"articles": await collect_feed_articles(sources)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch news stream: {str(e)}")
 
@@ -958,27 +4009,7 @@ async def get_sports_news():
             {"url": "https://www.skysports.com/rss/12040", "name": "Sky Sports"}
         ]
         
-        def fetch_source(src):
-            try:
-                resp = requests.get(src["url"], timeout=5)
-                feed = feedparser.parse(resp.content)
-                items = []
-                for entry in feed.entries[:10]:
-                    items.append({
-                        "title": entry.title,
-                        "link": entry.link,
-                        "published": entry.get('published', ''),
-                        "source": src["name"]
-                    })
-                return items
-            except Exception:
-                return []
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(fetch_source, sources))
-        
-        all_articles = [item for sublist in results for item in sublist]
-        return {"articles": all_articles[:40]}
+        return {"articles": await collect_feed_articles(sources)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch sports stream: {str(e)}")
 
@@ -1050,50 +4081,35 @@ async def get_live_scores():
     ]
     return {"matches": matches}
 
-@app.post("/api/scores/predict")
-async def predict_match(req: AIRequest):
-    prompt = (
-        f"You are an expert sports analyst AI for Gistly.site. Calculate the approximate live winning probability for this match "
-        f"based on the current live match context. "
-        f"Provide a short 2-3 sentence analysis of the situation and explicitly state the winning percentages for both teams.\n\n"
-        f"Match Context:\n{req.content}\n"
-    )
-    result = await generate_ai_response(prompt)
-    return {"result": result}
-
 @app.post("/api/news/summarize")
 async def news_summarize(req: AIRequest):
-    try:
-        url = req.content.strip()
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "text/html"
-        }
-        # Follow redirects in case of Google News proxy links
-        response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
-        response.raise_for_status()
+    url = req.content.strip()
+    return await scrape_flights.do(
+        flight_key("news-summarize", url, req.context),
+        lambda: summarize_news_url(url, req.context),
+    )
 
-        soup = BeautifulSoup(response.content, "html.parser")
 
-        # Basic Article Extraction (trying common tags)
-        texts = soup.find_all(["p", "h1", "h2", "article", "section"])
-        content = " ".join([t.get_text() for t in texts])
+async def summarize_news_url(url: str, context: str):
+    try:
+        # Redirects (e.g. Google News proxy links) are followed once and memoized
+        content = await article_store.fetch(url, "news", timeout=15)
         
         # Fallback if too short
         if len(content) < 200:
-             content = req.context # If frontend passed some context like the title
-
-        prompt = (
-            f"You are an expert Social Media AI for 'Gistly.site'. Summarize the following news article into a highly engaging, viral, and easy-to-read social media post format.\n"
-            f"Requirements:\n"
-            f"- Add an attention-grabbing headline (with emojis).\n"
-            f"- Break down the key facts into 3-4 bullet points.\n"
-            f"- Add 3-5 relevant trending #hashtags at the bottom.\n"
-            f"- End the post specifically with: '💡 Summarized via Gistly.site'\n\n"
-            f"News Content to summarize:\n{content[:50000]}"
+             content = context # If frontend passed some context like the title
+
+        prompt_template = (
+            "You are an expert Social Media AI for 'Gistly.site'. Summarize the following news article into a highly engaging, viral, and easy-to-read social media post format.\n"
+            "Requirements:\n"
+            "- Add an attention-grabbing headline (with emojis).\n"
+            "- Break down the key facts into 3-4 bullet points.\n"
+            "- Add 3-5 relevant trending #hashtags at the bottom.\n"
+            "- End the post specifically with: '💡 Summarized via Gistly.site'\n\n"
+            "News Content to summarize:\n{content}"
         )
         
-        result = await generate_ai_response(prompt)
+        result = await summarize_long_text(content, prompt_template, "news-summarize")
         return {"result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process news link: {str(e)}")
@@ -1195,7 +4211,7 @@ async def analyze_market(req: AIRequest):
             f"---\n"
             f"⚠️ *Disclaimer: Generated via Gistly.site Neural Network. Not financial advice. Always DYOR.*"
         )
-        result = await generate_ai_response(prompt)
+        result = await generate_ai_response(prompt, tool="markets-analyze")
         return {"result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Market analysis failed: {str(e)}")
@@ -1363,7 +4379,7 @@ async def get_my_keys(email: str):
     res = supabase.table("api_keys").select("*").eq("user_email", email).execute()
     return res.data
 
-async def validate_api_key(api_key: str):
+async def validate_api_key(api_key: str, credits: float = 1.0, endpoint: str = "neural_operation"):
     """Validate an API key and deduct balance for marketplace monetization."""
     if not supabase:
         return True # Default to true for testing if DB is down
@@ -1373,18 +4389,18 @@ async def validate_api_key(api_key: str):
         return False
     
     key_info = res.data[0]
-    if key_info["balance"] <= 0:
+    if key_info["balance"] <= 0 or key_info["balance"] < credits:
         return "insufficient_balance"
     
-    # Deduct 1 credit per neural operation
-    new_balance = key_info["balance"] - 1.0
+    # Deduct 1 credit per neural operation (batches are charged per item)
+    new_balance = key_info["balance"] - credits
     supabase.table("api_keys").update({"balance": new_balance}).eq("api_key", api_key).execute()
     
     # Track usage (Insert into api_usage table if it exists)
     try:
         supabase.table("api_usage").insert({
             "api_key_id": key_info["id"],
-            "endpoint": "neural_operation"
+            "endpoint": endpoint
         }).execute()
     except:
         pass # Optional tracking
@@ -1443,7 +4459,7 @@ async def create_checkout_session(request: CheckoutRequest):
             }
         }
         
-        response = requests.post(
+        response = await outbound.post(
             "https://api.lemonsqueezy.com/v1/checkouts", 
             json=payload, 
             headers=headers
@@ -1479,7 +4495,7 @@ async def create_paypal_order(request: PayPalOrderRequest):
             "Content-Type": "application/x-www-form-urlencoded"
         }
         token_data = {"grant_type": "client_credentials"}
-        token_response = requests.post(f"{base_url}/v1/oauth2/token", headers=token_headers, data=token_data)
+        token_response = await outbound.post(f"{base_url}/v1/oauth2/token", headers=token_headers, data=token_data)
         token_response.raise_for_status()
         access_token = token_response.json()["access_token"]
         
@@ -1510,7 +4526,7 @@ async def create_paypal_order(request: PayPalOrderRequest):
             }
         }
         
-        response = requests.post(f"{base_url}/v2/checkout/orders", json=payload, headers=headers)
+        response = await outbound.post(f"{base_url}/v2/checkout/orders", json=payload, headers=headers)
         response.raise_for_status()
         order_data = response.json()
         
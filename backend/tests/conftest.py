@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# main.py opens its SQLite stores and image secret under the data dir at import
+os.environ.setdefault("GISTLY_DATA_DIR", tempfile.mkdtemp(prefix="gistly-tests-"))
+
+
+@pytest.fixture(scope="session")
+def main():
+    return pytest.importorskip("main", reason="backend requirements are not installed")
@@ -0,0 +1,18 @@
+import pytest
+
+
+def test_token_bucket_refills_up_to_capacity(main):
+    bucket = main.TokenBucket(capacity=10, per_second=2)
+    bucket.level = 0
+    bucket.refill(bucket.updated + 2)
+    assert bucket.level == pytest.approx(4)
+    bucket.refill(bucket.updated + 100)
+    assert bucket.level == 10
+
+
+def test_token_bucket_wait_estimate(main):
+    bucket = main.TokenBucket(capacity=10, per_second=2)
+    bucket.level = 4
+    assert bucket.seconds_until(4) == 0
+    assert bucket.seconds_until(8) == pytest.approx(2)
+    assert bucket.seconds_until(50) == pytest.approx(3)  # Capped at capacity so it can ever be met
@@ -0,0 +1,7 @@
+def test_canonical_url_drops_tracking_and_sorts_query(main):
+    url = "HTTPS://Example.COM:443/post?utm_source=x&b=2&fbclid=y&a=1#section"
+    assert main.canonical_url(url) == "https://example.com/post?a=1&b=2"
+
+
+def test_canonical_url_keeps_non_default_port_and_adds_root_path(main):
+    assert main.canonical_url("http://example.com:8080") == "http://example.com:8080/"
@@ -0,0 +1,42 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+
+def test_batch_charges_only_known_tools(main, monkeypatch):
+    charged = []
+
+    async def validate_api_key(api_key, credits=1.0, endpoint="neural_operation"):
+        charged.append(credits)
+        return True
+
+    async def generate_ai_response(prompt, tool=None, content=None):
+        await asyncio.sleep(0)
+        return f"{tool} answer"
+
+    monkeypatch.setattr(main, "validate_api_key", validate_api_key)
+    monkeypatch.setattr(main, "generate_ai_response", generate_ai_response)
+    items = [
+        {"tool": "summarize", "content": "a"},
+        {"tool": "no-such-tool", "content": "b"},
+        {"tool": "summarize", "content": "c"},
+    ]
+    response = TestClient(main.app).post("/api/batch", json={"items": items}, headers={"X-API-KEY": "key"})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r.get("result") for r in results] == ["summarize answer", None, "summarize answer"]
+    assert results[1]["status_code"] == 404
+    assert charged == [2.0]
+
+
+def test_batch_of_unknown_tools_is_free(main, monkeypatch):
+    async def validate_api_key(api_key, credits=1.0, endpoint="neural_operation"):
+        raise AssertionError("nothing billable was run")
+
+    monkeypatch.setattr(main, "validate_api_key", validate_api_key)
+    response = TestClient(main.app).post(
+        "/api/batch", json={"items": [{"tool": "no-such-tool", "content": "x"}]}, headers={"X-API-KEY": "key"}
+    )
+    assert response.status_code == 200
+    assert response.json()["results"][0]["status_code"] == 404
@@ -0,0 +1,58 @@
+import pytest
+
+import extraction
+from extraction import BlockBuilder, TokenizerAdapter, extract_article_text
+
+LONG = "This sentence is long enough, with a comma, to count as article content."
+
+
+def blocks(html: str) -> list[str]:
+    builder = BlockBuilder()
+    tokenizer = TokenizerAdapter(builder)
+    tokenizer.feed(html)
+    tokenizer.close()
+    return [block["text"] for block in builder.close().blocks]
+
+
+def test_unclosed_paragraphs_become_separate_blocks():
+    assert blocks("<div><p>first<p>second<p>third</div>") == ["first", "second", "third"]
+
+
+def test_unclosed_list_items_become_separate_blocks():
+    assert blocks("<ul><li>one<li>two<li>three</ul>") == ["one", "two", "three"]
+
+
+def test_nested_block_text_is_not_counted_twice():
+    assert blocks("<article><section><p>only once</p></section></article>") == ["only once"]
+
+
+def test_skipped_tags_are_dropped():
+    assert blocks("<p>kept<script>var dropped = 1;</script></p><nav><p>menu</p></nav>") == ["kept"]
+
+
+def test_br_separates_words():
+    assert blocks("<p>line<br>break</p>") == ["line break"]
+
+
+def test_main_content_prefers_article_over_link_heavy_sidebar():
+    html = (
+        "<html><body>"
+        f"<div class='sidebar'><p><a href='/a'>{LONG}</a></p></div>"
+        f"<div class='post-content'><p>{LONG} One.</p><p>{LONG} Two.</p><p>{LONG} Three.</p></div>"
+        "</body></html>"
+    ).encode()
+    text = extract_article_text(html, "webpage", backend="tokenizer")
+    assert text.split("\n\n") == [f"{LONG} One.", f"{LONG} Two.", f"{LONG} Three."]
+
+
+def test_declared_charset_is_honoured():
+    html = "<meta charset='iso-8859-1'><p>café</p>".encode("iso-8859-1")
+    assert "café" in extraction.decode_html(html)
+
+
+@pytest.mark.skipif(extraction.lxml_etree is None, reason="lxml is not installed")
+def test_lxml_and_tokenizer_agree():
+    html = f"<div><p>{LONG} A.<p>{LONG} B.<ul><li>{LONG} C.<li>{LONG} D.</ul></div>".encode()
+    assert extract_article_text(html, "webpage", backend="lxml") == extract_article_text(
+        html, "webpage", backend="tokenizer"
+    )
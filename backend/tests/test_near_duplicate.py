@@ -0,0 +1,38 @@
+WORDS = " ".join(f"word{i}" for i in range(120))
+
+
+def test_minhash_ignores_short_texts(main):
+    assert main.minhash_signature("too short to compare") is None
+
+
+def test_minhash_is_stable_and_case_insensitive(main):
+    assert main.minhash_signature(WORDS) == main.minhash_signature(WORDS.upper())
+
+
+def test_near_duplicate_cache_matches_small_edits_only(main):
+    cache = main.NearDuplicateCache(max_entries=10)
+    cache.insert("tool", main.minhash_signature(WORDS), "cached answer", ttl=60)
+
+    edited = WORDS.replace("word60", "changed")
+    assert cache.lookup("tool", main.minhash_signature(edited), threshold=0.8) == "cached answer"
+    assert cache.lookup("other-tool", main.minhash_signature(edited), threshold=0.8) is None
+    unrelated = " ".join(f"other{i}" for i in range(120))
+    assert cache.lookup("tool", main.minhash_signature(unrelated), threshold=0.8) is None
+
+
+def test_near_duplicate_cache_evicts_oldest_and_its_buckets(main):
+    cache = main.NearDuplicateCache(max_entries=1)
+    first = main.minhash_signature(WORDS)
+    second = main.minhash_signature(" ".join(f"other{i}" for i in range(120)))
+    cache.insert("tool", first, "first", ttl=60)
+    cache.insert("tool", second, "second", ttl=60)
+    assert cache.lookup("tool", first, threshold=0.8) is None
+    assert cache.lookup("tool", second, threshold=0.8) == "second"
+    assert all(bucket <= set(cache.entries) for bucket in cache.buckets.values())
+
+
+def test_near_duplicate_cache_skips_expired_entries(main):
+    cache = main.NearDuplicateCache(max_entries=10)
+    signature = main.minhash_signature(WORDS)
+    cache.insert("tool", signature, "stale", ttl=-1)
+    assert cache.lookup("tool", signature, threshold=0.8) is None
@@ -0,0 +1,52 @@
+import asyncio
+
+
+def test_single_flight_coalesces_concurrent_calls(main):
+    flights = main.SingleFlight("test")
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", compute) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert calls == 1
+    assert flights.stats == {"leaders": 1, "followers": 4}
+    assert flights.inflight == {}
+
+
+def test_single_flight_shares_exceptions_and_releases_key(main):
+    flights = main.SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.inflight == {}
+
+
+def test_single_flight_survives_a_cancelled_follower(main):
+    flights = main.SingleFlight("test")
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do("key", compute))
+        follower = asyncio.ensure_future(flights.do("key", compute))
+        await asyncio.sleep(0)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(run()) == "answer"
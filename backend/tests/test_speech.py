@@ -0,0 +1,10 @@
+def test_speech_chunks_start_with_a_single_sentence(main):
+    text = "Hello there. This is the second sentence. And a third one follows."
+    chunks = main.speech_chunks(text, max_chars=200)
+    assert chunks == ["Hello there.", "This is the second sentence. And a third one follows."]
+
+
+def test_speech_chunks_split_overlong_sentences_on_spaces(main):
+    chunks = main.speech_chunks("word " * 100, max_chars=50)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == ["word"] * 100
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+
+def test_chunk_text_respects_max_chars_and_overlaps(main):
+    sentences = [f"Sentence number {i} says something." for i in range(40)]
+    chunks = main.chunk_text(" ".join(sentences), max_chars=200, overlap=60)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.split(". ")[0] in previous  # Each chunk opens with the tail of the last one
+
+
+def test_chunk_text_keeps_every_sentence(main):
+    sentences = [f"Point {i} is made here." for i in range(30)]
+    joined = " ".join(main.chunk_text(" ".join(sentences), max_chars=120, overlap=0))
+    assert all(sentence in joined for sentence in sentences)
+
+
+def test_chunk_text_slices_unbreakable_text(main):
+    chunks = main.chunk_text("x" * 250, max_chars=100, overlap=0)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+
+def test_summarize_long_text_rejects_inputs_over_the_chunk_cap(main, monkeypatch):
+    async def generate_ai_response(prompt, tool=None, content=None):
+        raise AssertionError("no provider call should be made")
+
+    monkeypatch.setattr(main, "generate_ai_response", generate_ai_response)
+    monkeypatch.setattr(main, "SUMMARY_SINGLE_PASS_CHARS", 100)
+    monkeypatch.setattr(main, "SUMMARY_CHUNK_CHARS", 100)
+    monkeypatch.setattr(main, "SUMMARY_MAX_CHUNKS", 3)
+    with pytest.raises(main.HTTPException) as excinfo:
+        asyncio.run(main.summarize_long_text("Some sentence here. " * 50, "{content}", "summarize"))
+    assert excinfo.value.status_code == 413
+
+
+def test_summarize_long_text_cancels_sibling_calls_on_failure(main, monkeypatch):
+    cancelled = []
+
+    async def generate_ai_response(prompt, tool=None, content=None):
+        if "part 1 of" in prompt:
+            raise main.HTTPException(status_code=500, detail="provider down")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(tool)
+            raise
+        return "notes"
+
+    monkeypatch.setattr(main, "generate_ai_response", generate_ai_response)
+    monkeypatch.setattr(main, "SUMMARY_SINGLE_PASS_CHARS", 100)
+    monkeypatch.setattr(main, "SUMMARY_CHUNK_CHARS", 100)
+    async def run():
+        with pytest.raises(main.HTTPException):
+            await main.summarize_long_text("Some sentence here. " * 20, "{content}", "summarize")
+        await asyncio.sleep(0)  # Let the cancellations land before the loop shuts down
+        return list(cancelled)
+
+    cancelled_before_shutdown = asyncio.run(run())
+    assert cancelled_before_shutdown and all(tool == "summarize:map" for tool in cancelled_before_shutdown)
@@ -0,0 +1,24 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "dQw4w9WgXcQ",
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42s",
+        "https://youtu.be/dQw4w9WgXcQ?si=abc",
+        "youtube.com/shorts/dQw4w9WgXcQ",
+        "https://m.youtube.com/embed/dQw4w9WgXcQ",
+        "https://music.youtube.com/watch?v=dQw4w9WgXcQ",
+    ],
+)
+def test_youtube_video_id_accepts_known_forms(main, url):
+    assert main.youtube_video_id(url) == "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize(
+    "url",
+    ["https://example.com/watch?v=dQw4w9WgXcQ", "https://www.youtube.com/watch?v=short", "https://youtu.be/"],
+)
+def test_youtube_video_id_rejects_other_urls(main, url):
+    assert main.youtube_video_id(url) is None
@@ -0,0 +1,58 @@
+import asyncio
+
+from starlette.requests import Request
+
+
+def audio_request() -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": [(b"accept", b"audio/mpeg")]})
+
+
+def fake_stream(*events):
+    async def stream_ai_response(prompt, tool=None):
+        for event in events:
+            await asyncio.sleep(0)
+            yield event
+
+    return stream_ai_response
+
+
+async def fake_speak(sentence, lang):
+    return f"{lang}:{sentence}|".encode()
+
+
+def collect(main, request):
+    async def run():
+        response = await main.overlapped_voice_response("prompt", request)
+        chunks = [chunk async for chunk in response.body_iterator]
+        body = b"".join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in chunks)
+        return response, body
+
+    return asyncio.run(run())
+
+
+def test_audio_headers_use_language_announced_after_a_fallback(main, monkeypatch):
+    monkeypatch.setattr(main, "speak_sentence", fake_speak)
+    monkeypatch.setattr(main, "stream_ai_response", fake_stream(
+        ("fallback", {"provider": "Groq", "discard_partial": False}),
+        ("token", {"text": "fr|Bonjour. "}),
+        ("token", {"text": "Au revoir."}),
+        ("done", {"provider": "Groq"}),
+    ))
+    response, body = collect(main, audio_request())
+    assert response.headers["X-Detected-Lang"] == "fr"
+    assert body == b"fr:Bonjour.|fr:Au revoir.|"
+
+
+def test_sse_reports_tts_failures_as_error_events(main, monkeypatch):
+    async def failing_speak(sentence, lang):
+        raise RuntimeError("tts down")
+
+    monkeypatch.setattr(main, "speak_sentence", failing_speak)
+    monkeypatch.setattr(main, "stream_ai_response", fake_stream(
+        ("token", {"text": "en|Hello there. "}),
+        ("done", {"provider": "Gemini"}),
+    ))
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": []})
+    _, body = collect(main, request)
+    assert b"event: lang" in body
+    assert b"event: error" in body and b"tts down" in body
@@ -1111,7 +1111,7 @@ const DraggableNode = ({ data, removeNode, updateNodePosition, exportNodeData })
                                             </div>
                                         )}
                                         <img
-                                            src={`data:image/png;base64,${result}`}
+                                            src={/^https?:\/\//.test(result) ? result : `data:image/png;base64,${result}`}
                                             className={cn("w-full h-full object-cover transition-all duration-1000", (imageLoading || imageError || !result) ? "opacity-0 grayscale" : "opacity-100")}
                                             alt="Render"
                                             onLoad={() => { setImageLoading(false); setImageError(false); }}